@@ -3,9 +3,21 @@ Debugging & Testing Script for Full Stack DR Detection System
 Tests both backend API and frontend connectivity
 """
 
+import atexit
 import requests
 import json
 import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+
+# Shared session so every probe reuses a pooled keep-alive connection
+# instead of opening a fresh TCP connection per request, with a dedicated
+# connection pool for each service
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=0))
+for host in ("http://localhost:8001", "http://localhost:3000"):
+    SESSION.mount(host, HTTPAdapter(pool_connections=2, pool_maxsize=10, max_retries=0))
+atexit.register(SESSION.close)
 
 print("=" * 70)
 print("🔍 DR DETECTION SYSTEM - DEBUG & TEST")
@@ -14,102 +26,128 @@ print("=" * 70)
 # ============================================================================
 # TEST 1: Backend Health Check
 # ============================================================================
-print("\n[TEST 1] 🏥 Backend Health Check")
-print("-" * 70)
-
-try:
-    response = requests.get("http://localhost:8001/health", timeout=5)
-    if response.status_code == 200:
-        data = response.json()
-        print(f"✅ Backend is HEALTHY")
-        print(f"   Status: {data.get('status')}")
-        print(f"   Model Loaded: {data.get('model_loaded')}")
-        print(f"   Service: {data.get('service')}")
-    else:
-        print(f"❌ Backend returned status code: {response.status_code}")
-except Exception as e:
-    print(f"❌ Backend unreachable: {e}")
+def check_backend_health():
+    out = []
+    try:
+        response = SESSION.get("http://localhost:8001/health", timeout=5)
+        if response.status_code == 200:
+            data = response.json()
+            out.append(f"✅ Backend is HEALTHY")
+            out.append(f"   Status: {data.get('status')}")
+            out.append(f"   Model Loaded: {data.get('model_loaded')}")
+            out.append(f"   Service: {data.get('service')}")
+        else:
+            out.append(f"❌ Backend returned status code: {response.status_code}")
+    except Exception as e:
+        out.append(f"❌ Backend unreachable: {e}")
+    return out
 
 # ============================================================================
 # TEST 2: Model Info Endpoint
 # ============================================================================
-print("\n[TEST 2] 🧠 Model Information")
-print("-" * 70)
-
-try:
-    response = requests.get("http://localhost:8001/model-info", timeout=5)
-    if response.status_code == 200:
-        data = response.json()
-        print(f"✅ Model info retrieved successfully")
-        print(f"   Model Name: {data.get('model_name')}")
-        print(f"   Architecture: {data.get('architecture')}")
-        print(f"   Input Shape: {data.get('input_shape')}")
-        print(f"   Classes: {data.get('num_classes')}")
-        print(f"   Total Parameters: {data.get('total_parameters'):,}")
-except Exception as e:
-    print(f"❌ Failed to get model info: {e}")
+def check_model_info():
+    out = []
+    try:
+        response = SESSION.get("http://localhost:8001/model-info", timeout=5)
+        if response.status_code == 200:
+            data = response.json()
+            out.append(f"✅ Model info retrieved successfully")
+            out.append(f"   Model Name: {data.get('model_name')}")
+            out.append(f"   Architecture: {data.get('architecture')}")
+            out.append(f"   Input Shape: {data.get('input_shape')}")
+            out.append(f"   Classes: {data.get('num_classes')}")
+            total_parameters = data.get('total_parameters')
+            out.append(f"   Total Parameters: {total_parameters:,}" if total_parameters
+                       else "   Total Parameters: unknown")
+    except Exception as e:
+        out.append(f"❌ Failed to get model info: {e}")
+    return out
 
 # ============================================================================
 # TEST 3: CORS Headers Check (for frontend)
 # ============================================================================
-print("\n[TEST 3] 🌐 CORS Configuration")
-print("-" * 70)
-
-try:
-    response = requests.options(
-        "http://localhost:8001/predict",
-        headers={"Origin": "http://localhost:3000"}
-    )
-    cors_headers = {
-        "Access-Control-Allow-Origin": response.headers.get("Access-Control-Allow-Origin"),
-        "Access-Control-Allow-Methods": response.headers.get("Access-Control-Allow-Methods"),
-        "Access-Control-Allow-Headers": response.headers.get("Access-Control-Allow-Headers"),
-    }
-    
-    if cors_headers["Access-Control-Allow-Origin"]:
-        print(f"✅ CORS enabled for frontend")
-        print(f"   Allow-Origin: {cors_headers['Access-Control-Allow-Origin']}")
-        print(f"   Allow-Methods: {cors_headers['Access-Control-Allow-Methods']}")
-    else:
-        print(f"⚠️  CORS headers not fully configured")
-except Exception as e:
-    print(f"⚠️  CORS check failed: {e}")
+def check_cors():
+    out = []
+    try:
+        response = SESSION.options(
+            "http://localhost:8001/predict",
+            headers={"Origin": "http://localhost:3000"}
+        )
+        cors_headers = {
+            "Access-Control-Allow-Origin": response.headers.get("Access-Control-Allow-Origin"),
+            "Access-Control-Allow-Methods": response.headers.get("Access-Control-Allow-Methods"),
+            "Access-Control-Allow-Headers": response.headers.get("Access-Control-Allow-Headers"),
+        }
+
+        if cors_headers["Access-Control-Allow-Origin"]:
+            out.append(f"✅ CORS enabled for frontend")
+            out.append(f"   Allow-Origin: {cors_headers['Access-Control-Allow-Origin']}")
+            out.append(f"   Allow-Methods: {cors_headers['Access-Control-Allow-Methods']}")
+        else:
+            out.append(f"⚠️  CORS headers not fully configured")
+    except Exception as e:
+        out.append(f"⚠️  CORS check failed: {e}")
+    return out
 
 # ============================================================================
 # TEST 4: API Error Handling
 # ============================================================================
-print("\n[TEST 4] 🚨 Error Handling")
-print("-" * 70)
-
-try:
-    # Test with invalid file
-    response = requests.post(
-        "http://localhost:8001/predict",
-        files={"file": ("test.txt", b"invalid data")}
-    )
-    if response.status_code == 400:
-        print(f"✅ API properly handles invalid file types")
-        print(f"   Error: {response.json().get('detail')}")
-    else:
-        print(f"❌ Unexpected response: {response.status_code}")
-except Exception as e:
-    print(f"❌ Error handling test failed: {e}")
+def check_error_handling():
+    out = []
+    try:
+        # Test with invalid file
+        response = SESSION.post(
+            "http://localhost:8001/predict",
+            files={"file": ("test.txt", b"invalid data")}
+        )
+        if response.status_code == 400:
+            out.append(f"✅ API properly handles invalid file types")
+            out.append(f"   Error: {response.json().get('detail')}")
+        else:
+            out.append(f"❌ Unexpected response: {response.status_code}")
+    except Exception as e:
+        out.append(f"❌ Error handling test failed: {e}")
+    return out
 
 # ============================================================================
 # TEST 5: Frontend Accessibility
 # ============================================================================
-print("\n[TEST 5] 🖥️  Frontend Server")
-print("-" * 70)
+def check_frontend():
+    out = []
+    try:
+        # HEAD is enough to tell the server is up without downloading the page;
+        # a 405 still means the server answered
+        response = SESSION.head("http://localhost:3000", timeout=5, allow_redirects=True)
+        if response.status_code < 400 or response.status_code == 405:
+            out.append(f"✅ Frontend is accessible at http://localhost:3000")
+            out.append(f"   Server is responding with status {response.status_code}")
+        else:
+            out.append(f"⚠️  Frontend returned status: {response.status_code}")
+    except Exception as e:
+        out.append(f"⚠️  Frontend may not be ready: {e}")
+    return out
 
-try:
-    response = requests.get("http://localhost:3000", timeout=5)
-    if response.status_code == 200:
-        print(f"✅ Frontend is accessible at http://localhost:3000")
-        print(f"   Server is responding with status 200")
-    else:
-        print(f"⚠️  Frontend returned status: {response.status_code}")
-except Exception as e:
-    print(f"⚠️  Frontend may not be ready: {e}")
+# ============================================================================
+# Run TEST 1-5
+# ============================================================================
+# The probes are independent, so run them concurrently on the shared session
+# and print each report in test order once all of them have finished.
+CHECKS = [
+    ("[TEST 1] 🏥 Backend Health Check", check_backend_health),
+    ("[TEST 2] 🧠 Model Information", check_model_info),
+    ("[TEST 3] 🌐 CORS Configuration", check_cors),
+    ("[TEST 4] 🚨 Error Handling", check_error_handling),
+    ("[TEST 5] 🖥️  Frontend Server", check_frontend),
+]
+
+with ThreadPoolExecutor(max_workers=len(CHECKS)) as executor:
+    reports = [executor.submit(check) for _, check in CHECKS]
+
+for (title, _), report in zip(CHECKS, reports):
+    print(f"\n{title}")
+    print("-" * 70)
+    for line in report.result():
+        print(line)
 
 # ============================================================================
 # TEST 6: Network Connectivity Summary
@@ -123,13 +161,20 @@ services = {
     "Model Service": "http://localhost:8001/model-info",
 }
 
-for service_name, service_url in services.items():
-    try:
-        response = requests.head(service_url, timeout=2)
-        status = "✅ RUNNING" if response.status_code < 500 else "❌ ERROR"
-        print(f"{status} - {service_name}: {service_url}")
-    except:
-        print(f"❌ DOWN - {service_name}: {service_url}")
+# Probe all services concurrently so one slow/down service doesn't delay the rest
+with ThreadPoolExecutor(max_workers=len(services)) as executor:
+    futures = {
+        executor.submit(SESSION.head, service_url, timeout=2): (service_name, service_url)
+        for service_name, service_url in services.items()
+    }
+    for future in as_completed(futures):
+        service_name, service_url = futures[future]
+        try:
+            response = future.result()
+            status = "✅ RUNNING" if response.status_code < 500 else "❌ ERROR"
+            print(f"{status} - {service_name}: {service_url}")
+        except:
+            print(f"❌ DOWN - {service_name}: {service_url}")
 
 # ============================================================================
 # SUMMARY
@@ -154,8 +199,8 @@ print("""
    3. Click "Analyze Image" to get predictions
    4. View results with confidence scores and probabilities
 
-⚠️  NOTE: First prediction may take longer (~30 seconds) as the model
-   initializes. Subsequent predictions will be faster.
+⚠️  NOTE: The backend warms up the model on startup, so it may take a
+   while before /health responds. Predictions are fast once it is up.
 
 🐛 DEBUGGING TIPS:
    - Check backend logs for inference errors
@@ -13,6 +13,7 @@ Author: DR Detection System Team
 Date: November 2025
 """
 
+import hashlib
 import os
 import subprocess
 import sys
@@ -22,6 +23,8 @@ from pathlib import Path
 MODELS = {
     'fusion_dr_model.keras': {
         'size': '277.8 MB',
+        'bytes': 291256590,
+        'sha256': 'f29c86bcdbde56882c57da4a2d4ba8c52ffdc668bbf585465964c08c847f1fd7',
         'epochs': 30,
         'accuracy': '77.35%',
         'description': 'Primary Keras model (native format, recommended)',
@@ -29,6 +32,8 @@ MODELS = {
     },
     'fusion_dr_model.h5': {
         'size': '276.8 MB',
+        'bytes': 290295696,
+        'sha256': '01833d455ddb0da8de5c19654b18ab3e91d6f8cb47dd0edf10b1c21ce10fd087',
         'epochs': 30,
         'accuracy': '77.35%',
         'description': 'HDF5 format weights (backup/legacy)',
@@ -36,6 +41,8 @@ MODELS = {
     },
     'fusion_dr_model_final.keras': {
         'size': '277.8 MB',
+        'bytes': 291256590,
+        'sha256': '61390f4fa0733b105b79b31e3760fa8743a8b0acc5eff1796243fec1a2b4884b',
         'epochs': 30,
         'accuracy': '77.35%',
         'description': 'Final Keras model with Lambda layers (evaluation)',
@@ -43,6 +50,9 @@ MODELS = {
     }
 }
 
+# Number of parallel LFS transfers used when pulling the models
+LFS_CONCURRENT_TRANSFERS = 8
+
 
 def print_header():
     """Print welcome header"""
@@ -95,14 +105,15 @@ def download_models():
     print("\n📥 Downloading models from GitHub LFS...\n")
     
     try:
-        # First, fetch LFS metadata
-        print("Step 1: Fetching LFS metadata...")
-        subprocess.run(['git', 'lfs', 'fetch'], check=True, cwd=Path(__file__).parent)
-        print("✅ LFS metadata fetched")
-        
-        # Then checkout (pull) the files
-        print("\nStep 2: Pulling model files...")
-        subprocess.run(['git', 'lfs', 'checkout'], check=True, cwd=Path(__file__).parent)
+        # Fetch and check out only the model files in a single LFS pass,
+        # downloading the model objects in parallel
+        subprocess.run(
+            ['git', '-c', f'lfs.concurrenttransfers={LFS_CONCURRENT_TRANSFERS}',
+             'lfs', 'pull', '--include=fusion_dr_model*'],
+            check=True,
+            cwd=Path(__file__).parent,
+            env={**os.environ, 'GIT_LFS_SKIP_SMUDGE': '0'}
+        )
         print("✅ Model files downloaded")
         
         return True
@@ -114,22 +125,47 @@ def download_models():
         return False
 
 
+def sha256_of(path):
+    """Compute the SHA-256 hex digest of a file without reading it into memory at once"""
+    with open(path, 'rb') as f:
+        if hasattr(hashlib, 'file_digest'):  # Python 3.11+
+            return hashlib.file_digest(f, 'sha256').hexdigest()
+        digest = hashlib.sha256()
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+        return digest.hexdigest()
+
+
 def verify_models():
-    """Verify that model files exist and have correct size indicators"""
+    """Verify that model files exist and match their expected size and SHA-256"""
     print("\n🔍 Verifying downloaded models...\n")
     
     project_root = Path(__file__).parent
     models_exist = True
     
-    for model_name in MODELS.keys():
+    for model_name, info in MODELS.items():
         model_path = project_root / model_name
         
-        if model_path.exists():
-            size_mb = model_path.stat().st_size / (1024 * 1024)
-            print(f"✅ {model_name}: {size_mb:.1f} MB")
-        else:
+        if not model_path.exists():
             print(f"❌ {model_name}: NOT FOUND")
             models_exist = False
+            continue
+        
+        # Cheap check first: catches un-smudged LFS pointers and truncated downloads
+        size_bytes = model_path.stat().st_size
+        size_mb = size_bytes / (1024 * 1024)
+        if size_bytes != info['bytes']:
+            print(f"❌ {model_name}: {size_mb:.1f} MB (expected {info['size']}, "
+                  f"incomplete download or LFS pointer)")
+            models_exist = False
+            continue
+        
+        if sha256_of(model_path) != info['sha256']:
+            print(f"❌ {model_name}: {size_mb:.1f} MB (checksum mismatch, file is corrupt)")
+            models_exist = False
+            continue
+        
+        print(f"✅ {model_name}: {size_mb:.1f} MB (checksum OK)")
     
     return models_exist
 
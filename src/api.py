@@ -4,12 +4,14 @@ Serves predictions from the trained fusion model via REST API
 """
 
 import os
-import io
-import cv2
+import asyncio
+import hashlib
+from collections import OrderedDict
 import numpy as np
 import tensorflow as tf
 from contextlib import asynccontextmanager
 from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from PIL import Image
@@ -22,9 +24,11 @@ if src_dir not in sys.path:
     sys.path.insert(0, src_dir)
 
 # Import custom model components
-from preprocessing import _circular_crop, _gaussian_blur
+from preprocessing import _crop_blur_resize
 from loss import focal_loss_fn
-from model import ModelFusionLayer, build_fusion_model
+from model import (ModelFusionLayer, count_trainable_params, describe_architecture, enable_mixed_precision,
+                   fusion_backbones, load_fusion_checkpoint, prefetch_weights)
+from inference_backend import batch_buckets, is_export_current, load_tflite_predict_fn, read_export_info
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -33,6 +37,33 @@ logger = logging.getLogger(__name__)
 # Global model variable
 model = None
 
+# (total, trainable) parameter counts, computed once at startup for /model-info
+param_counts = None
+
+# Architecture name of the loaded model (e.g. "VGG16 + ResNet50 + DenseNet121
+# with Attention"), determined once at startup for /model-info
+architecture = None
+
+# Inference function: takes a float32 (N, 224, 224, 3) batch and returns
+# (N, 5) class probabilities as a numpy array (built once at startup)
+infer_fn = None
+
+# Micro-batching: concurrent /predict requests are queued and run through the
+# model together, up to MAX_BATCH_SIZE images or MAX_BATCH_WAIT_MS of waiting
+MAX_BATCH_SIZE = int(os.environ.get("DR_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_WAIT_MS = float(os.environ.get("DR_MAX_BATCH_WAIT_MS", "20"))
+batch_queue = None
+
+# Batch sizes infer_fn is run at when it compiles or allocates per input shape
+# (XLA SavedModel, TFLite): each micro-batch is padded up to the smallest one
+# that fits. None runs every batch at its own size.
+batch_sizes = None
+
+# LRU cache of prediction responses keyed by a hash of the uploaded bytes,
+# so re-uploading the same image skips preprocessing and inference
+PREDICTION_CACHE_SIZE = 128
+prediction_cache = OrderedDict()
+
 # Class mapping for output
 CLASS_NAMES = {
     0: "No DR",
@@ -45,12 +76,17 @@ CLASS_NAMES = {
 def load_keras_model():
     """
     Load the trained Keras model with custom objects.
-    Attempts to load fusion_dr_model.keras (30-epoch clean version) first, 
-    falls back to rebuilding from HDF5 if needed.
+    Attempts to load the fusion_dr_savedmodel export (see convert_to_savedmodel.py)
+    first, then the weights-only export (see convert_model.py), then
+    fusion_dr_model.keras (30-epoch clean version), and
+    falls back to rebuilding from HDF5 if needed. Exports not converted from
+    the checkpoint on disk are skipped.
     """
     global model
     
     root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    model_path_savedmodel = os.path.join(root_dir, "fusion_dr_savedmodel")
+    model_path_weights = os.path.join(root_dir, "fusion_dr_model.weights.h5")  # weights-only export
     model_path_keras = os.path.join(root_dir, "fusion_dr_model.keras")  # 30-epoch clean version
     model_path_h5 = os.path.join(root_dir, "fusion_dr_model.h5")  # 30-epoch weights
     
@@ -60,9 +96,31 @@ def load_keras_model():
     }
     
     try:
-        # Try loading native Keras format first
+        # Try the SavedModel export first: it skips Keras layer reconstruction
+        if os.path.isdir(model_path_savedmodel) and is_export_current(model_path_savedmodel, root_dir):
+            logger.info(f"Loading SavedModel from {model_path_savedmodel}")
+            model = tf.saved_model.load(model_path_savedmodel)
+            logger.info("✅ Model loaded successfully from SavedModel")
+            return model
+    except Exception as e:
+        logger.warning(f"Failed to load SavedModel: {e}")
+    
+    try:
+        # Then the weights-only export on top of the rebuilt architecture
+        if os.path.exists(model_path_weights) and is_export_current(model_path_weights, root_dir):
+            logger.info(f"Rebuilding model architecture and loading weights from {model_path_weights}")
+            logger.info(f"Using dtype policy: {enable_mixed_precision()}")
+            model = load_fusion_checkpoint(model_path_weights)
+            logger.info("✅ Model rebuilt and weights loaded from weights-only export")
+            return model
+    except Exception as e:
+        logger.warning(f"Failed to load weights-only export: {e}")
+    
+    try:
+        # Then native Keras format
         if os.path.exists(model_path_keras):
             logger.info(f"Loading model from {model_path_keras}")
+            prefetch_weights(model_path_keras)
             model = tf.keras.models.load_model(
                 model_path_keras,
                 custom_objects=custom_objects,
@@ -77,8 +135,8 @@ def load_keras_model():
         # Fallback: rebuild architecture and load weights from HDF5
         if os.path.exists(model_path_h5):
             logger.info(f"Rebuilding model architecture and loading weights from {model_path_h5}")
-            model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5)
-            model.load_weights(model_path_h5)
+            logger.info(f"Using dtype policy: {enable_mixed_precision()}")
+            model = load_fusion_checkpoint(model_path_h5)
             logger.info("✅ Model rebuilt and weights loaded from HDF5")
             return model
     except Exception as e:
@@ -88,18 +146,135 @@ def load_keras_model():
     raise FileNotFoundError(f"Model files not found at {model_path_keras} or {model_path_h5}")
 
 
+def build_infer_fn():
+    """
+    Build the inference function used by /predict.
+    On CPU-only hosts prefers the quantized fusion_dr_model.tflite when
+    present (the full model is then never loaded). Otherwise loads the model
+    and uses the XLA-compiled serving function of a SavedModel, or wraps the
+    Keras model in a tf.function with a fixed input signature so every
+    request reuses one concrete function instead of going through the
+    Model.predict loop.
+    """
+    global infer_fn, batch_sizes
+
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    model_path_tflite = os.path.join(root_dir, "fusion_dr_model.tflite")
+
+    # GPU hosts keep serving the full-precision model on the GPU. One
+    # interpreter is allocated per batch bucket batch_worker pads to.
+    if (not tf.config.list_physical_devices("GPU") and os.path.exists(model_path_tflite)
+            and is_export_current(model_path_tflite, root_dir)):
+        tflite_fn = load_tflite_predict_fn(model_path_tflite, batch_sizes=batch_buckets(MAX_BATCH_SIZE))
+        if tflite_fn is not None:
+            logger.info(f"Using TFLite model for inference: {model_path_tflite}")
+            infer_fn = tflite_fn
+            batch_sizes = batch_buckets(MAX_BATCH_SIZE)
+            return infer_fn
+
+    if model is None:
+        load_keras_model()
+        logger.info("✅ Model loaded successfully")
+
+    if not isinstance(model, tf.keras.Model):
+        # XLA compiles the serving function once per input shape
+        infer_fn = lambda batch: model.serve(tf.constant(batch)).numpy()
+        batch_sizes = batch_buckets(MAX_BATCH_SIZE)
+        return infer_fn
+
+    @tf.function(input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float32)])
+    def _infer(x):
+        return model(x, training=False)
+
+    infer_fn = lambda batch: _infer(tf.constant(batch)).numpy()
+    return infer_fn
+
+
+def warmup_model():
+    """
+    Run dummy forward passes so graph tracing, XLA compilation and kernel
+    selection happen at startup instead of on the first /predict request.
+    Covers every batch size batches are padded to, or a single image and a
+    full batch when batches run unpadded.
+    """
+    logger.info("🔥 Warming up model")
+    for size in batch_sizes or (1, MAX_BATCH_SIZE):
+        infer_fn(np.zeros((size, 224, 224, 3), dtype=np.float32))
+    logger.info("✅ Model warmup complete")
+
+
+async def batch_worker(queue: asyncio.Queue):
+    """
+    Background task that drains the request queue into micro-batches.
+    Waits for a first image, then collects more until the batch is full or
+    MAX_BATCH_WAIT_MS has elapsed, and runs the whole batch in one call.
+    """
+    loop = asyncio.get_running_loop()
+    # Batches are run one at a time, so a single preallocated input buffer
+    # can be reused for every batch instead of allocating one per call.
+    # Batches run at their own size unless batch_sizes is set; then they are
+    # padded up to the next bucket (padding rows' outputs are dropped).
+    batch_buffer = np.zeros((MAX_BATCH_SIZE, 224, 224, 3), dtype=np.float32)
+    while True:
+        items = [await queue.get()]
+        deadline = loop.time() + MAX_BATCH_WAIT_MS / 1000.0
+        while len(items) < MAX_BATCH_SIZE:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        try:
+            # Inside the try: a failure here must reach the waiting requests
+            # instead of killing the worker and leaving every later one hanging
+            n = len(items)
+            run_size = n if batch_sizes is None else next(b for b in batch_sizes if b >= n)
+            np.stack([image for image, _ in items], axis=0, out=batch_buffer[:n])
+            # Run inference off the event loop so new requests keep queueing
+            predictions = await loop.run_in_executor(None, infer_fn, batch_buffer[:run_size])
+        except Exception as e:
+            for _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            continue
+
+        for (_, future), probabilities in zip(items, predictions):
+            if not future.done():
+                future.set_result(probabilities)
+
+
+async def run_inference(image: np.ndarray) -> np.ndarray:
+    """
+    Submit one preprocessed (224, 224, 3) image to the micro-batching queue
+    and wait for its (5,) probability vector.
+    """
+    future = asyncio.get_running_loop().create_future()
+    await batch_queue.put((image, future))
+    return await future
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
     Lifespan context manager to load model on startup and cleanup on shutdown
     """
-    # Startup: Load model
+    global batch_queue, param_counts, architecture
+
+    # Startup: Load model (or only the TFLite interpreter on CPU-only hosts)
     logger.info("🚀 Starting up... Loading model")
-    load_keras_model()
-    logger.info("✅ Model loaded successfully")
+    build_infer_fn()
+    param_counts = count_parameters()
+    architecture = model_architecture()
+    warmup_model()
+    batch_queue = asyncio.Queue()
+    batch_task = asyncio.create_task(batch_worker(batch_queue))
     yield
     # Shutdown: Cleanup (if needed)
     logger.info("🛑 Shutting down")
+    batch_task.cancel()
 
 
 # Initialize FastAPI app
@@ -120,47 +295,38 @@ app.add_middleware(
 )
 
 
-def preprocess_image(image_bytes: bytes, target_size: tuple = (224, 224)) -> np.ndarray:
+def preprocess_image(image: Image.Image, target_size: tuple = (224, 224)) -> np.ndarray:
     """
     Preprocess image exactly as done during training:
-    1. Load image and convert to RGB
+    1. Convert image to RGB
     2. Apply circular crop
     3. Apply Gaussian blur (sigma=10)
     4. Resize to target_size
     5. Normalize (divide by 255.0)
     
     Args:
-        image_bytes: Raw image bytes
+        image: Decoded PIL image
         target_size: Target image size (default: 224x224)
     
     Returns:
         Preprocessed image as numpy array
     """
     try:
-        # Load image from bytes
-        image = Image.open(io.BytesIO(image_bytes))
-        
         # Convert to RGB (handles RGBA, grayscale, etc.)
         if image.mode != 'RGB':
             image = image.convert('RGB')
         
-        # Convert PIL to OpenCV format (BGR)
-        image_cv = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-        
-        # Apply circular crop (mask out background)
-        image_cv = _circular_crop(image_cv)
-        
-        # Apply Gaussian blur (sigma=10)
-        image_cv = _gaussian_blur(image_cv, sigma=10)
-        
-        # Resize to 224x224
-        image_cv = cv2.resize(image_cv, target_size)
+        # Work on the RGB pixels directly: crop, blur and resize act on each
+        # channel independently, so no BGR round-trip is needed
+        image_cv = np.asarray(image, dtype=np.uint8)
         
-        # Convert BGR back to RGB for model input
-        image_rgb = cv2.cvtColor(image_cv, cv2.COLOR_BGR2RGB)
+        # Apply circular crop, Gaussian blur and resize to 224x224, using the
+        # same helper as the training/evaluation loader
+        image_cv = _crop_blur_resize(image_cv, target_size=target_size)
         
-        # Normalize: divide by 255.0
-        image_rgb = image_rgb.astype(np.float32) / 255.0
+        # Normalize: divide by 255.0 straight into a float32 buffer
+        image_rgb = np.empty(image_cv.shape, dtype=np.float32)
+        np.divide(image_cv, np.float32(255.0), out=image_rgb)
         
         logger.info(f"Image preprocessed successfully. Shape: {image_rgb.shape}")
         return image_rgb
@@ -170,12 +336,37 @@ def preprocess_image(image_bytes: bytes, target_size: tuple = (224, 224)) -> np.
         raise ValueError(f"Failed to preprocess image: {str(e)}")
 
 
+def hash_upload(f) -> tuple:
+    """
+    Hash an uploaded file in chunks straight from Starlette's spooled file
+    instead of reading it into one bytes object.
+    
+    Returns:
+        Tuple of the digest and the number of bytes read
+    """
+    hasher = hashlib.blake2b(digest_size=16)
+    f.seek(0)
+    num_bytes = 0
+    for chunk in iter(lambda: f.read(65536), b''):
+        hasher.update(chunk)
+        num_bytes += len(chunk)
+    return hasher.digest(), num_bytes
+
+
+def decode_and_preprocess(f) -> np.ndarray:
+    """Decode an uploaded file and run preprocess_image on it."""
+    f.seek(0)
+    image = Image.open(f)
+    image.load()
+    return preprocess_image(image)
+
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
-        "model_loaded": model is not None,
+        "model_loaded": infer_fn is not None,
         "service": "Diabetic Retinopathy Detection API"
     }
 
@@ -194,7 +385,7 @@ async def predict(file: UploadFile = File(...)):
     Returns:
         JSON with diagnosis, confidence, and per-class probabilities
     """
-    if model is None:
+    if infer_fn is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
     try:
@@ -207,22 +398,26 @@ async def predict(file: UploadFile = File(...)):
                 detail=f"Unsupported file type: {file_ext}. Allowed: {', '.join(allowed_extensions)}"
             )
         
-        # Read file bytes
-        contents = await file.read()
-        if len(contents) == 0:
+        # Hashing, decoding and preprocessing read the spooled upload from
+        # disk and work on the full-resolution image, so they run in the
+        # threadpool to keep the event loop (and the micro-batcher) responsive
+        cache_key, num_bytes = await run_in_threadpool(hash_upload, file.file)
+        if num_bytes == 0:
             raise HTTPException(status_code=400, detail="Empty file uploaded")
         
+        # Serve repeated uploads of the same image from the cache
+        if cache_key in prediction_cache:
+            prediction_cache.move_to_end(cache_key)
+            logger.info(f"Cache hit for image: {file.filename}")
+            return JSONResponse(prediction_cache[cache_key])
+        
         # Preprocess image
         logger.info(f"Processing image: {file.filename}")
-        preprocessed_image = preprocess_image(contents)
-        
-        # Add batch dimension: (1, 224, 224, 3)
-        input_batch = np.expand_dims(preprocessed_image, axis=0)
+        preprocessed_image = await run_in_threadpool(decode_and_preprocess, file.file)
         
-        # Run inference
+        # Run inference (batched with any concurrent requests)
         logger.info("Running model inference")
-        predictions = model.predict(input_batch, verbose=0)
-        probabilities = predictions[0]  # Shape: (5,)
+        probabilities = await run_inference(preprocessed_image)  # Shape: (5,)
         
         # Get predicted class
         predicted_class = int(np.argmax(probabilities))
@@ -239,14 +434,19 @@ async def predict(file: UploadFile = File(...)):
         
         logger.info(f"Prediction complete: {diagnosis} (confidence: {confidence:.4f})")
         
-        return JSONResponse({
+        response = {
             "status": "success",
             "diagnosis": diagnosis,
             "severity": severity,
             "confidence": round(confidence, 4),
             "probabilities": prob_dict,
             "recommended_action": get_recommended_action(predicted_class)
-        })
+        }
+        prediction_cache[cache_key] = response
+        if len(prediction_cache) > PREDICTION_CACHE_SIZE:
+            prediction_cache.popitem(last=False)
+        
+        return JSONResponse(response)
     
     except HTTPException:
         raise
@@ -275,20 +475,56 @@ def get_recommended_action(class_index: int) -> str:
     return recommendations.get(class_index, "Unknown diagnosis")
 
 
+def count_parameters():
+    """
+    Get (total, trainable) parameter counts of the loaded model.
+    
+    Returns:
+        Tuple of total and trainable parameter counts (0 when unknown)
+    """
+    if model is None:
+        # Serving from TFLite: convert_to_tflite.py stores the counts in the
+        # export's sidecar, so the Keras model is never built. Sidecars written
+        # before the counts were added report 0.
+        root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        info = read_export_info(os.path.join(root_dir, "fusion_dr_model.tflite")) or {}
+        return int(info.get("total_parameters", 0)), int(info.get("trainable_parameters", 0))
+    if isinstance(model, tf.keras.Model):
+        return model.count_params(), count_trainable_params(model)
+    # SavedModel export stores the counts alongside the weights
+    return int(model.total_parameters.numpy()), int(model.trainable_parameters.numpy())
+
+
+def model_architecture():
+    """
+    Get the architecture name of the loaded model from its backbones.
+    
+    Returns:
+        Architecture string, or None when an export does not record it
+    """
+    if isinstance(model, tf.keras.Model):
+        return describe_architecture(fusion_backbones(model))
+    # TFLite and SavedModel exports record it in their sidecar (see the convert scripts)
+    root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    export_name = "fusion_dr_model.tflite" if model is None else "fusion_dr_savedmodel"
+    return (read_export_info(os.path.join(root_dir, export_name)) or {}).get("architecture")
+
+
 @app.get("/model-info")
 async def model_info():
     """Get information about the loaded model"""
-    if model is None:
+    if infer_fn is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
     
+    total_parameters, trainable_parameters = param_counts
     return {
         "model_name": "Fusion DR Detection Model",
-        "architecture": "VGG16 + ResNet50 + DenseNet121 with Attention",
+        "architecture": architecture,
         "input_shape": (224, 224, 3),
         "num_classes": 5,
         "classes": CLASS_NAMES,
-        "total_parameters": model.count_params(),
-        "trainable_parameters": sum([tf.size(w).numpy() for w in model.trainable_weights])
+        "total_parameters": total_parameters,
+        "trainable_parameters": trainable_parameters
     }
 
 
@@ -0,0 +1,33 @@
+import os
+
+import pandas as pd
+# Import local modules from src/ (when running from project root these are on sys.path)
+from preprocessing import TRAIN_CACHE_PATH, build_image_index, preprocess_fingerprint, write_preprocessed_cache
+
+# --- CONFIG ---
+CSV_PATH = os.path.join("data", "train.csv")
+IMAGES_DIR = os.path.join("data", "train_images")
+TARGET_SIZE = (224, 224)
+
+
+def main():
+    df = pd.read_csv(CSV_PATH)
+    id_codes = [str(i).strip() for i in df["id_code"]]
+
+    image_index = build_image_index(IMAGES_DIR)
+    paths = []
+    for id_code in id_codes:
+        p = image_index.get(id_code)
+        if p is None:
+            raise FileNotFoundError(f"Image for id {id_code} not found in {IMAGES_DIR}")
+        paths.append(p)
+
+    print(f"Preprocessing {len(paths)} images into {TRAIN_CACHE_PATH}...")
+    fingerprint = preprocess_fingerprint(paths, target_size=TARGET_SIZE)
+    # TrainSequence only uses the cache while the fingerprint and id list match
+    write_preprocessed_cache(TRAIN_CACHE_PATH, paths, id_codes, fingerprint, target_size=TARGET_SIZE)
+    print(f"✅ Cache written: {TRAIN_CACHE_PATH}")
+
+
+if __name__ == "__main__":
+    main()
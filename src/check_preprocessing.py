@@ -0,0 +1,85 @@
+import os
+import argparse
+import sys
+
+import cv2
+import numpy as np
+import pandas as pd
+
+# reuse preprocessing helpers from our module
+from preprocessing import _circular_crop, build_image_index
+
+
+def _reference_uint8(image_path: str, target_size=(224, 224)) -> np.ndarray:
+    """The preprocessing the published weights were trained with: circular crop
+    and sigma=10 Gaussian blur at full resolution, then resize to target."""
+    img = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+    img = _circular_crop(img)
+    img = cv2.GaussianBlur(img, ksize=(0, 0), sigmaX=10.0, sigmaY=10.0)
+    return cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
+
+
+def _candidate_uint8(image_path: str, target_size=(224, 224)) -> np.ndarray:
+    """The cheaper resize-then-blur pipeline: circular crop at full resolution,
+    resize to target, then blur the small image with sigma rescaled per axis so
+    it approximates a sigma=10 blur at the original resolution. Not used by the
+    loaders until this check and an evaluation show it matches the reference."""
+    img = cv2.cvtColor(cv2.imread(image_path), cv2.COLOR_BGR2RGB)
+    orig_h, orig_w = img.shape[:2]
+    img = _circular_crop(img)
+    img = cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(img, ksize=(0, 0), sigmaX=10.0 * target_size[0] / orig_w,
+                            sigmaY=10.0 * target_size[1] / orig_h)
+
+
+def main(args):
+    csv_path = args.csv or os.path.join(os.getcwd(), "data", "train.csv")
+    images_dir = args.images or os.path.join(os.getcwd(), "data", "train_images")
+
+    ids = pd.read_csv(csv_path)["id_code"].astype(str).str.strip().tolist()
+    image_index = build_image_index(images_dir)
+    paths = [image_index[i] for i in ids if i in image_index][: args.num]
+    if not paths:
+        print("No images found to compare. Exiting.")
+        return 1
+
+    # Absolute pixel differences on the uint8 (0-255) scale. The mean alone
+    # hides localized artifacts (e.g. at the circle edge), so the 99th
+    # percentile and the maximum are reported and gated as well.
+    diffs = []
+    for p in paths:
+        diff = np.abs(_candidate_uint8(p).astype(np.int16) - _reference_uint8(p).astype(np.int16))
+        diffs.append(diff.ravel())
+        print(f"{os.path.basename(p)}: max={int(diff.max())} p99={np.percentile(diff, 99):.1f} "
+              f"mean={float(diff.mean()):.3f}")
+
+    diffs = np.concatenate(diffs)
+    max_diff = int(diffs.max())
+    p99_diff = float(np.percentile(diffs, 99))
+    mean_diff = float(diffs.mean())
+    print(f"\n{len(paths)} images: max={max_diff} (tolerance {args.max_tolerance}) "
+          f"p99={p99_diff:.1f} (tolerance {args.p99_tolerance}) "
+          f"mean={mean_diff:.3f} (tolerance {args.tolerance})")
+    if max_diff > args.max_tolerance or p99_diff > args.p99_tolerance or mean_diff > args.tolerance:
+        print("❌ Resize-then-blur deviates from the pipeline the weights were trained with")
+        return 1
+    print("✅ Resize-then-blur matches the training pipeline within tolerance; confirm with "
+          "evaluate.py (accuracy and kappa) before switching the loaders to it")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the resize-then-blur preprocessing with the full-resolution blur "
+                    "the published weights were trained with, on a few APTOS images")
+    parser.add_argument("--csv", help="Path to train.csv", default=None)
+    parser.add_argument("--images", help="Path to train_images dir", default=None)
+    parser.add_argument("--num", help="Number of images to compare", type=int, default=20)
+    parser.add_argument("--tolerance", help="Maximum allowed mean abs pixel difference (0-255 scale)",
+                        type=float, default=1.0)
+    parser.add_argument("--p99-tolerance", help="Maximum allowed 99th percentile abs pixel difference",
+                        type=float, default=4.0)
+    parser.add_argument("--max-tolerance", help="Maximum allowed abs pixel difference of any pixel",
+                        type=float, default=16.0)
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -1,7 +1,7 @@
 import os
 import tensorflow as tf
 
-from preprocessing import get_train_generator
+from preprocessing import get_train_dataset
 from loss import focal_loss
 
 
@@ -31,8 +31,10 @@ def main():
     # loading the native .keras full model (may contain Lambda layers).
     if os.path.exists(h5_path):
         print("Rebuilding architecture and loading weights from HDF5:", h5_path)
-        from model import build_fusion_model
-        model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5)
+        from model import build_fusion_model, enable_mixed_precision, prefetch_weights
+        prefetch_weights(h5_path)
+        print("Using dtype policy:", enable_mixed_precision())
+        model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5, weights=None)
         model.load_weights(h5_path)
     elif os.path.exists(keras_path):
         print("Attempting to load full model from native Keras file:", keras_path)
@@ -53,21 +55,21 @@ def main():
     loss_fn = focal_loss(gamma=2.0, alpha=0.25)
     model.compile(optimizer=opt, loss=loss_fn, metrics=[tf.keras.metrics.CategoricalAccuracy()])
 
-    # Data generator
-    train_gen = get_train_generator(batch_size=batch_size)
+    # Data pipeline (prefetches batches while the model trains)
+    train_ds = get_train_dataset(batch_size=batch_size)
 
-    # Optional: checkpoint callback to save best model in native format
+    # Optional: checkpoint callback to save the model every epoch in native
+    # format, as a float32 model so loading it on CPU does not run float16
+    from model import Float32Checkpoint, save_float32
     ckpt_path = os.path.join(os.getcwd(), "fusion_dr_model.keras")
-    checkpoint_cb = tf.keras.callbacks.ModelCheckpoint(
-        ckpt_path, save_best_only=False, monitor="loss", save_weights_only=False
-    )
+    checkpoint_cb = Float32Checkpoint(ckpt_path, save_best_only=False, monitor="loss")
 
     print(f"Resuming training from epoch {start_epoch} to {target_epochs} (batch_size={batch_size})")
-    model.fit(train_gen, epochs=target_epochs, initial_epoch=start_epoch, callbacks=[checkpoint_cb])
+    model.fit(train_ds, epochs=target_epochs, initial_epoch=start_epoch, callbacks=[checkpoint_cb])
 
     # Save final model
     print("Saving final model to native Keras format...")
-    model.save(ckpt_path, include_optimizer=False)
+    save_float32(model, ckpt_path)
     print("Resume training complete.")
 
 
@@ -1,9 +1,10 @@
 import os
 import tensorflow as tf
-from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, CSVLogger
-from preprocessing import get_train_generator
+from tensorflow.keras.callbacks import ReduceLROnPlateau, CSVLogger
+from preprocessing import get_train_dataset
 from loss import focal_loss_fn
-from model import ModelFusionLayer, build_fusion_model  # use builder to avoid HDF5 lambda issues
+from model import (ModelFusionLayer, Float32Checkpoint, build_fusion_model, enable_mixed_precision,
+                   prefetch_weights, save_float32)
 
 # --- CONFIGURATION ---
 # We load the model you just built (10 epochs)
@@ -28,7 +29,7 @@ def main():
 
     # 2. Load Data
     print(f"Loading Data Generator (Batch Size: {BATCH_SIZE})...")
-    train_gen = get_train_generator(batch_size=BATCH_SIZE)
+    train_ds = get_train_dataset(batch_size=BATCH_SIZE)
 
     # 3. Load the Existing 10-Epoch Model
     print(f"Loading previous brain: {OLD_MODEL_PATH}...")
@@ -38,9 +39,11 @@ def main():
         return
 
     try:
-        # Rebuild architecture and load weights from HDF5 to avoid Lambda deserialization issues
+        # Rebuild architecture in code and load only the weights from the HDF5
         print("Rebuilding model architecture...")
-        model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5)
+        prefetch_weights(OLD_MODEL_PATH)
+        print(f"Using dtype policy: {enable_mixed_precision()}")
+        model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5, weights=None)
         print(f"Loading weights from {OLD_MODEL_PATH}...")
         model.load_weights(OLD_MODEL_PATH)
         print("✅ Weights loaded successfully. Ready for Phase 2.")
@@ -55,8 +58,9 @@ def main():
     # 4. Define Smart Callbacks (The "Secret Sauce" from the Paper)
     
     # A. Checkpoint: Saves the model every time accuracy improves.
-    # If the PC crashes, you don't lose progress.
-    checkpoint = ModelCheckpoint(
+    # If the PC crashes, you don't lose progress. Saved as a float32 model so
+    # loading it on CPU does not run float16 compute.
+    checkpoint = Float32Checkpoint(
         NEW_MODEL_PATH,
         monitor='categorical_accuracy',
         verbose=1,
@@ -84,7 +88,7 @@ def main():
     try:
         # Run training (omit workers/use_multiprocessing to avoid platform mismatches)
         model.fit(
-            train_gen,
+            train_ds,
             epochs=EXTRA_EPOCHS,
             callbacks=[checkpoint, reduce_lr, csv_logger]
         )
@@ -92,7 +96,7 @@ def main():
 
     except KeyboardInterrupt:
         print("\n⚠️ Interrupted! Saving whatever we have so far...")
-        model.save("fusion_dr_model_interrupted.keras")
+        save_float32(model, "fusion_dr_model_interrupted.keras")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,26 +1,26 @@
 import tensorflow as tf
 # Import local modules from src/ (when running from project root these are on sys.path)
 from loss import focal_loss_fn
-from model import ModelFusionLayer, build_fusion_model
+from model import ModelFusionLayer, load_fusion_checkpoint
+from inference_backend import write_export_info
 
 # --- CONFIG ---
 OLD_PATH = "fusion_dr_model.h5"
-NEW_PATH = "fusion_dr_model.keras"
+NEW_PATH = "fusion_dr_model.weights.h5"
 
 def main():
     print(f"Loading legacy model: {OLD_PATH}...")
     try:
-        # Rebuild the architecture in code and load weights from the HDF5.
-        # This avoids Lambda deserialization problems.
-        print("Building model architecture...")
-        model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5)
-        print("Loading weights from HDF5...")
-        model.load_weights(OLD_PATH)
+        print("Building model architecture and loading weights from HDF5...")
+        model = load_fusion_checkpoint(OLD_PATH)
 
-        # Save in new native Keras format
-        print(f"Saving to native format: {NEW_PATH}...")
-        model.save(NEW_PATH, include_optimizer=False)
-        print("✅ Success! You should now use 'fusion_dr_model.keras' for everything.")
+        # Save weights only: loaders rebuild the architecture with
+        # build_fusion_model anyway, so serializing the model config in a
+        # full model save is unnecessary
+        print(f"Saving weights: {NEW_PATH}...")
+        model.save_weights(NEW_PATH)
+        write_export_info(NEW_PATH, OLD_PATH)
+        print(f"✅ Success! The API will now load '{NEW_PATH}' on top of build_fusion_model().")
 
     except Exception as e:
         print(f"❌ Error: {e}")
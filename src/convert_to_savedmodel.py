@@ -0,0 +1,46 @@
+import tensorflow as tf
+# Import local modules from src/ (when running from project root these are on sys.path)
+from model import count_trainable_params, load_fusion_checkpoint
+from inference_backend import write_export_info
+
+# --- CONFIG ---
+WEIGHTS_PATH = "fusion_dr_model.h5"
+SAVEDMODEL_PATH = "fusion_dr_savedmodel"
+
+
+class ServingModule(tf.Module):
+    """Inference-only wrapper around the fusion model for SavedModel export.
+
+    Exposes an XLA-compiled ``serve`` function and stores the parameter counts
+    reported by the API's /model-info endpoint, so the API can run without
+    rebuilding the Keras model.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+        self.total_parameters = tf.Variable(model.count_params(), dtype=tf.int64, trainable=False)
+        self.trainable_parameters = tf.Variable(count_trainable_params(model), dtype=tf.int64, trainable=False)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, 224, 224, 3], tf.float32)], jit_compile=True)
+    def serve(self, x):
+        return self.model(x, training=False)
+
+
+def main():
+    print(f"Loading model weights: {WEIGHTS_PATH}...")
+    try:
+        model = load_fusion_checkpoint(WEIGHTS_PATH)
+
+        module = ServingModule(model)
+        print(f"Saving SavedModel: {SAVEDMODEL_PATH}...")
+        tf.saved_model.save(module, SAVEDMODEL_PATH,
+                            signatures={"serving_default": module.serve.get_concrete_function()})
+        write_export_info(SAVEDMODEL_PATH, WEIGHTS_PATH, model)
+        print(f"✅ Success! The API will now load '{SAVEDMODEL_PATH}' at startup.")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+
+if __name__ == "__main__":
+    main()
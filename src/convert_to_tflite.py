@@ -0,0 +1,116 @@
+import os
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+# Import local modules from src/ (when running from project root these are on sys.path)
+from model import load_fusion_checkpoint
+from preprocessing import _load_and_preprocess, build_image_index
+from inference_backend import write_export_info
+
+# --- CONFIG ---
+WEIGHTS_PATH = "fusion_dr_model.h5"
+TFLITE_PATH = "fusion_dr_model.tflite"
+CSV_PATH = os.path.join("data", "train.csv")
+IMAGES_DIR = os.path.join("data", "train_images")
+NUM_CALIBRATION_SAMPLES = 100
+# Images after the calibration ones, used to compare the int8 model with the
+# float model before the export is written
+NUM_VALIDATION_SAMPLES = 200
+# The export is refused when the int8 model agrees with the float model on
+# fewer predicted labels than this
+MIN_LABEL_AGREEMENT = 0.98
+
+
+def sample_paths():
+    """Split training image paths into calibration and held-out validation sets.
+
+    Returns up to NUM_CALIBRATION_SAMPLES and NUM_VALIDATION_SAMPLES paths,
+    taken in CSV order without overlap.
+    """
+    if not os.path.exists(CSV_PATH):
+        return [], []
+    image_index = build_image_index(IMAGES_DIR)
+    paths = []
+    for id_code in pd.read_csv(CSV_PATH)["id_code"].astype(str):
+        p = image_index.get(id_code.strip())
+        if p is not None:
+            paths.append(p)
+        if len(paths) >= NUM_CALIBRATION_SAMPLES + NUM_VALIDATION_SAMPLES:
+            break
+    return paths[:NUM_CALIBRATION_SAMPLES], paths[NUM_CALIBRATION_SAMPLES:]
+
+
+def compare_with_float(model, tflite_model: bytes, paths):
+    """Run the converted model and the float Keras model on ``paths``.
+
+    Returns the fraction of images on which both predict the same label and
+    the largest absolute difference of any class probability.
+    """
+    interpreter = tf.lite.Interpreter(model_content=tflite_model, num_threads=os.cpu_count())
+    interpreter.allocate_tensors()
+    input_index = interpreter.get_input_details()[0]["index"]
+    output_index = interpreter.get_output_details()[0]["index"]
+
+    agree = 0
+    max_diff = 0.0
+    for p in paths:
+        x = np.expand_dims(_load_and_preprocess(p, target_size=(224, 224)), axis=0).astype(np.float32)
+        interpreter.set_tensor(input_index, x)
+        interpreter.invoke()
+        q_probs = interpreter.get_tensor(output_index)[0]
+        f_probs = model(x, training=False).numpy()[0]
+        agree += int(np.argmax(q_probs) == np.argmax(f_probs))
+        max_diff = max(max_diff, float(np.max(np.abs(q_probs - f_probs))))
+    return agree / len(paths), max_diff
+
+
+def main():
+    print(f"Loading model weights: {WEIGHTS_PATH}...")
+    try:
+        model = load_fusion_checkpoint(WEIGHTS_PATH)
+
+        converter = tf.lite.TFLiteConverter.from_keras_model(model)
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        paths, validation_paths = sample_paths()
+        if paths:
+            # Full int8 quantization of weights and activations, calibrated on
+            # real preprocessed fundus images. Input/output stay float32.
+            print(f"Calibrating int8 quantization on {len(paths)} images...")
+
+            def representative_dataset():
+                for p in paths:
+                    img = _load_and_preprocess(p, target_size=(224, 224))
+                    yield [np.expand_dims(img, axis=0).astype(np.float32)]
+
+            converter.representative_dataset = representative_dataset
+        else:
+            # No training data available: fall back to dynamic-range quantization
+            print("⚠️ No calibration images found, using dynamic-range quantization")
+
+        print(f"Converting to TFLite: {TFLITE_PATH}...")
+        tflite_model = converter.convert()
+
+        # The API serves this file automatically on CPU-only hosts, so check
+        # it against the float model before writing it
+        if validation_paths:
+            print(f"Comparing with the float model on {len(validation_paths)} held-out images...")
+            agreement, max_diff = compare_with_float(model, tflite_model, validation_paths)
+            print(f"Label agreement: {agreement:.2%}, max probability difference: {max_diff:.4f}")
+            if agreement < MIN_LABEL_AGREEMENT:
+                print(f"❌ Label agreement is below {MIN_LABEL_AGREEMENT:.0%}, not writing {TFLITE_PATH}")
+                return
+        else:
+            print("⚠️ WARNING: no held-out images found, the quantized model is NOT validated against "
+                  "the float model. Check its predictions before serving it.")
+
+        with open(TFLITE_PATH, "wb") as f:
+            f.write(tflite_model)
+        write_export_info(TFLITE_PATH, WEIGHTS_PATH, model)
+        print(f"✅ Success! Saved {len(tflite_model) / (1024 * 1024):.1f} MB to {TFLITE_PATH}")
+
+    except Exception as e:
+        print(f"❌ Error: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,10 @@ import numpy as np
 import pandas as pd
 import tensorflow as tf
 
-from preprocessing import _load_and_preprocess
-from model import build_fusion_model
+from preprocessing import build_image_index, get_eval_dataset
+from model import build_fusion_model, prefetch_weights
 from loss import focal_loss
+from inference_backend import autotune_batch_size, make_keras_predict_fn, predict_batches
 
 
 def enable_gpu_memory_growth():
@@ -22,47 +23,6 @@ def enable_gpu_memory_growth():
         print("Warning: could not set memory growth:", e)
 
 
-class EvalSequence(tf.keras.utils.Sequence):
-    def __init__(self, df, images_dir, batch_size=8, target_size=(224, 224), num_classes=5):
-        self.df = df.reset_index(drop=True)
-        self.images_dir = images_dir
-        self.batch_size = batch_size
-        self.target_size = target_size
-        self.num_classes = num_classes
-
-    def __len__(self):
-        return int(np.ceil(len(self.df) / float(self.batch_size)))
-
-    def _find_image_file(self, id_code: str):
-        for ext in (".png", ".jpg", ".jpeg"):
-            p = os.path.join(self.images_dir, id_code + ext)
-            if os.path.exists(p):
-                return p
-        p = os.path.join(self.images_dir, id_code)
-        if os.path.exists(p):
-            return p
-        return None
-
-    def __getitem__(self, idx):
-        batch_df = self.df.iloc[idx * self.batch_size:(idx + 1) * self.batch_size]
-        images = []
-        labels = []
-        ids = []
-        for _, row in batch_df.iterrows():
-            id_code = str(row['id_code']).strip()
-            lab = int(row['diagnosis'])
-            img_path = self._find_image_file(id_code)
-            if img_path is None:
-                raise FileNotFoundError(f"Image for id {id_code} not found in {self.images_dir}")
-            img = _load_and_preprocess(img_path, target_size=self.target_size)
-            images.append(img)
-            labels.append(lab)
-            ids.append(id_code)
-        x = np.stack(images, axis=0)
-        y = np.array(labels, dtype=np.int32)
-        return x, y, ids
-
-
 def main():
     enable_gpu_memory_growth()
 
@@ -91,6 +51,7 @@ def main():
 
     # Load model: prefer native .keras if present; else rebuild+load_weights from h5
     model = None
+    prefetch_weights(keras_path if os.path.exists(keras_path) else h5_path)
     if os.path.exists(keras_path):
         try:
             print("Loading model from native Keras file:", keras_path)
@@ -101,7 +62,7 @@ def main():
     if model is None:
         if os.path.exists(h5_path):
             print("Rebuilding model architecture and loading weights from HDF5")
-            model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5)
+            model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5, weights=None)
             model.load_weights(h5_path)
         else:
             raise FileNotFoundError('No model file found (.keras or .h5)')
@@ -111,24 +72,23 @@ def main():
     loss_fn = focal_loss(gamma=2.0, alpha=0.25)
     model.compile(optimizer=opt, loss=loss_fn, metrics=[tf.keras.metrics.CategoricalAccuracy()])
 
-    # Eval generator (no augmentation)
-    batch_size = 8
-    eval_seq = EvalSequence(val_df, images_dir, batch_size=batch_size)
-
-    # Collect predictions
-    all_ids = []
-    all_true = []
-    all_probs = []
-
-    for i in range(len(eval_seq)):
-        x_batch, y_batch, ids = eval_seq[i]
-        probs = model.predict(x_batch)
-        all_ids.extend(ids)
-        all_true.extend(y_batch.tolist())
-        all_probs.extend(probs.tolist())
-
-    y_true = np.array(all_true, dtype=int)
-    y_probs = np.array(all_probs, dtype=float)
+    # Eval pipeline (no augmentation)
+    predict_fn = make_keras_predict_fn(model)
+    batch_size = autotune_batch_size(predict_fn)
+    print(f"Evaluation batch size: {batch_size}")
+    all_ids = [str(id_code).strip() for id_code in val_df['id_code']]
+    image_index = build_image_index(images_dir)
+    image_paths = []
+    for id_code in all_ids:
+        img_path = image_index.get(id_code)
+        if img_path is None:
+            raise FileNotFoundError(f"Image for id {id_code} not found in {images_dir}")
+        image_paths.append(img_path)
+    eval_ds = get_eval_dataset(image_paths, batch_size=batch_size)
+
+    # Collect predictions in a single pass over the dataset
+    y_true = val_df['diagnosis'].to_numpy(dtype=int)
+    y_probs = predict_batches(predict_fn, eval_ds, num_samples=len(image_paths))
     y_pred = np.argmax(y_probs, axis=1)
 
     # Compute metrics
@@ -155,19 +115,35 @@ def main():
     with open(metrics_path, 'w') as f:
         json.dump(results, f, indent=2)
 
-    preds_df = pd.DataFrame({
+    preds_columns = {
         'id_code': all_ids,
-        'true_label': y_true.tolist(),
-        'pred_label': y_pred.tolist(),
-    })
-    # add probability columns
-    for c in range(y_probs.shape[1]):
-        preds_df[f'prob_{c}'] = y_probs[:, c]
-
-    preds_df['pred_prob'] = np.max(y_probs, axis=1)
+        'true_label': y_true,
+        'pred_label': y_pred,
+        # probability columns
+        **{f'prob_{c}': y_probs[:, c] for c in range(y_probs.shape[1])},
+        'pred_prob': np.max(y_probs, axis=1),
+    }
 
     preds_csv = os.path.join(out_dir, 'predictions.csv')
-    preds_df.to_csv(preds_csv, index=False)
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        pa = None
+    written = False
+    if pa is not None:
+        try:
+            # Arrow's C++ CSV writer, when pyarrow is installed. Unquoted like the
+            # pandas fallback (id_codes are hex, so nothing needs quoting), so the
+            # file layout does not depend on which writer ran. quoting_style
+            # needs pyarrow >= 11 (TypeError otherwise).
+            pa_csv.write_csv(pa.Table.from_pydict(preds_columns), preds_csv,
+                             write_options=pa_csv.WriteOptions(quoting_style="none"))
+            written = True
+        except (TypeError, pa.ArrowInvalid) as e:
+            print('pyarrow CSV writer failed, falling back to pandas:', e)
+    if not written:
+        pd.DataFrame(preds_columns).to_csv(preds_csv, index=False)
 
     if cm is not None:
         cm_df = pd.DataFrame(cm)
@@ -3,12 +3,11 @@ import json
 import numpy as np
 import pandas as pd
 import tensorflow as tf
-import matplotlib.pyplot as plt
-import seaborn as sns
 
-from preprocessing import _load_and_preprocess
+from preprocessing import build_image_index, get_eval_dataset
 from loss import focal_loss_fn
-from model import ModelFusionLayer, build_fusion_model
+from model import ModelFusionLayer, build_fusion_model, prefetch_weights
+from inference_backend import autotune_batch_size, make_keras_predict_fn, predict_label_batches
 
 # --- CONFIG ---
 MODEL_FILE = "fusion_dr_model_final.keras" 
@@ -22,43 +21,6 @@ def enable_gpu_memory_growth():
     except Exception as e:
         print("Warning:", e)
 
-class EvalSequence(tf.keras.utils.Sequence):
-    def __init__(self, df, images_dir, batch_size=8, target_size=(224, 224), num_classes=5):
-        self.df = df.reset_index(drop=True)
-        self.images_dir = images_dir
-        self.batch_size = batch_size
-        self.target_size = target_size
-        self.num_classes = num_classes
-
-    def __len__(self):
-        return int(np.ceil(len(self.df) / float(self.batch_size)))
-
-    def _find_image_file(self, id_code: str):
-        for ext in (".png", ".jpg", ".jpeg"):
-            p = os.path.join(self.images_dir, id_code + ext)
-            if os.path.exists(p): return p
-        p = os.path.join(self.images_dir, id_code)
-        if os.path.exists(p): return p
-        return None
-
-    def __getitem__(self, idx):
-        batch_df = self.df.iloc[idx * self.batch_size:(idx + 1) * self.batch_size]
-        images = []
-        labels = []
-        ids = []
-        for _, row in batch_df.iterrows():
-            id_code = str(row['id_code']).strip()
-            lab = int(row['diagnosis'])
-            img_path = self._find_image_file(id_code)
-            if img_path:
-                img = _load_and_preprocess(img_path, target_size=self.target_size)
-                images.append(img)
-                labels.append(lab)
-                ids.append(id_code)
-        
-        if not images: return np.array([]), np.array([]), []
-        return np.stack(images, axis=0), np.array(labels, dtype=np.int32), ids
-
 def main():
     enable_gpu_memory_growth()
     root = os.getcwd()
@@ -77,6 +39,7 @@ def main():
     model = None
     custom_objects = {"focal_loss_fixed": focal_loss_fn, "ModelFusionLayer": ModelFusionLayer}
     if os.path.exists(model_path):
+        prefetch_weights(model_path)
         try:
             model = tf.keras.models.load_model(model_path, custom_objects=custom_objects, compile=False)
             print("✅ Model loaded from native file!")
@@ -86,8 +49,9 @@ def main():
             h5_path = os.path.join(root, 'fusion_dr_model.h5')
             if os.path.exists(h5_path):
                 print("Rebuilding architecture and loading weights from HDF5:", h5_path)
+                prefetch_weights(h5_path)
                 try:
-                    model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5)
+                    model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5, weights=None)
                     model.load_weights(h5_path)
                     print("✅ Model rebuilt and weights loaded from HDF5")
                 except Exception as e2:
@@ -118,19 +82,23 @@ def main():
 
     print(f"📊 Evaluating on {len(val_df)} validation images...")
     
-    # Run Prediction
-    eval_seq = EvalSequence(val_df, images_dir, batch_size=8)
-    y_true, y_pred, y_probs = [], [], []
-
-    print("Running predictions (this takes ~3 mins)...")
-    for i in range(len(eval_seq)):
-        x, y, _ = eval_seq[i]
-        if len(x) == 0: continue
-        probs = model.predict(x, verbose=0)
-        y_true.extend(y)
-        y_pred.extend(np.argmax(probs, axis=1))
-        y_probs.extend(probs)
-        if i % 10 == 0: print(f"Batch {i}/{len(eval_seq)} done...")
+    # Run Prediction (images without a file on disk are skipped)
+    image_index = build_image_index(images_dir)
+    image_paths, y_true = [], []
+    for _, row in val_df.iterrows():
+        img_path = image_index.get(str(row['id_code']).strip())
+        if img_path:
+            image_paths.append(img_path)
+            y_true.append(int(row['diagnosis']))
+
+    # Only the predicted labels are needed, so the argmax runs on-device.
+    # Use the largest batch size that fits in GPU memory
+    label_fn = make_keras_predict_fn(model, labels_only=True)
+    batch_size = autotune_batch_size(label_fn)
+    eval_ds = get_eval_dataset(image_paths, batch_size=batch_size)
+
+    print(f"Running predictions (batch size {batch_size}, this takes ~3 mins)...")
+    y_pred = predict_label_batches(label_fn, eval_ds, num_samples=len(image_paths))
     
     # Calculate Metrics
     from sklearn.metrics import classification_report, confusion_matrix, accuracy_score, cohen_kappa_score
@@ -154,6 +122,13 @@ def main():
         f.write(f"Accuracy: {acc}\nKappa: {kappa}\n\n{report}")
 
     # Save Matrix Graph
+    # Plotting libraries are imported here so metric-only runs never pay for them;
+    # Agg renders straight to file without initializing a display backend.
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
     cm = confusion_matrix(y_true, y_pred)
     plt.figure(figsize=(8,6))
     sns.heatmap(cm, annot=True, fmt='d', cmap='Greens', xticklabels=["No", "Mild", "Mod", "Sev", "Pro"], yticklabels=["No", "Mild", "Mod", "Sev", "Pro"])
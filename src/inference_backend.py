@@ -0,0 +1,260 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+from model import count_trainable_params, describe_architecture, fusion_backbones
+
+# INT8 TFLite export written by convert_to_tflite.py
+TFLITE_MODEL_PATH = "fusion_dr_model.tflite"
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=8)
+def _sha256_of(path: str, size: int, mtime_ns: int) -> str:
+    # size and mtime_ns are part of the cache key, so a rewritten file is rehashed
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_sha256(path: str) -> str:
+    """SHA-256 hex digest of a file, hashed once per (size, mtime) of the file."""
+    st = os.stat(path)
+    return _sha256_of(path, st.st_size, st.st_mtime_ns)
+
+
+def export_info_path(export_path: str) -> str:
+    """Path of the JSON sidecar written next to a derived export (file or SavedModel dir)."""
+    return export_path.rstrip("/\\") + ".json"
+
+
+def write_export_info(export_path: str, source_path: str, model=None) -> None:
+    """Record which checkpoint ``export_path`` was converted from.
+
+    Writes the source file name, size and SHA-256 to the export's JSON
+    sidecar, so loaders (see is_export_current) can tell a stale export from a
+    current one regardless of file modification times. With ``model``, also
+    records its architecture name and parameter counts, so the API can report
+    them for the export without building the Keras model.
+    """
+    info = {
+        "source": {
+            "name": os.path.basename(source_path),
+            "bytes": os.path.getsize(source_path),
+            "sha256": file_sha256(source_path),
+        },
+    }
+    if model is not None:
+        info["architecture"] = describe_architecture(fusion_backbones(model))
+        info["total_parameters"] = model.count_params()
+        info["trainable_parameters"] = count_trainable_params(model)
+    with open(export_info_path(export_path), "w") as f:
+        json.dump(info, f, indent=2)
+
+
+def read_export_info(export_path: str):
+    """Load an export's JSON sidecar, or None when it is missing or unreadable."""
+    try:
+        with open(export_info_path(export_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def is_export_current(export_path: str, root_dir: str) -> bool:
+    """
+    Check that a derived export (SavedModel, weights-only, TFLite) was
+    converted from the checkpoint currently on disk. The convert scripts
+    record the source checkpoint's size and SHA-256 in a JSON sidecar next to
+    the export; file modification times are not used, since git lfs pull and
+    checkouts rewrite them. An export without a sidecar or with a mismatching
+    one is rejected with a warning, so callers fall back to the retrained
+    checkpoint instead of using an old conversion.
+    """
+    info = read_export_info(export_path)
+    if info is None or "source" not in info:
+        logger.warning(f"Skipping {export_path}: no source checkpoint record, re-run its convert script")
+        return False
+    source = info["source"]
+    source_path = os.path.join(root_dir, source["name"])
+    if (not os.path.isfile(source_path) or os.path.getsize(source_path) != source["bytes"]
+            or file_sha256(source_path) != source["sha256"]):
+        logger.warning(f"Skipping {export_path}: converted from a different {source['name']}, "
+                       f"re-run its convert script")
+        return False
+    return True
+
+
+def batch_buckets(max_batch_size: int):
+    """Power-of-two batch sizes up to ``max_batch_size`` (always included), e.g. (1, 2, 4, 8).
+
+    Backends that compile or allocate per input shape run each batch padded up
+    to the smallest bucket that fits, so a lone request does not pay for a
+    full-size batch while the number of shapes stays small.
+    """
+    sizes = []
+    b = 1
+    while b < max_batch_size:
+        sizes.append(b)
+        b *= 2
+    sizes.append(max_batch_size)
+    return tuple(sizes)
+
+
+def load_tflite_predict_fn(model_path: str = TFLITE_MODEL_PATH, batch_sizes=(8,)):
+    """Load the INT8 TFLite model exported by convert_to_tflite.py.
+
+    Runs on all CPU cores through the XNNPACK delegate. One interpreter is
+    allocated per size in ``batch_sizes``, since every resize re-prepares
+    XNNPACK; a batch runs on the smallest one that fits and is padded up to
+    it. Memory cost: every interpreter holds its own XNNPACK-packed copy of
+    the weights (roughly the .tflite file size) plus a tensor arena sized for
+    its batch, so the API's (1, 2, 4, 8) buckets take about four times the
+    memory of a single interpreter; pass fewer sizes to trade that for
+    padding. Returns a thread-safe callable mapping a float32
+    (N <= max(batch_sizes), 224, 224, 3) batch to (N, 5) class probabilities,
+    or None when no TFLite model is available.
+    """
+    if not os.path.isfile(model_path):
+        return None
+    runners = []
+    try:
+        with open(model_path, "rb") as f:
+            model_content = f.read()
+        for batch_size in sorted(batch_sizes):
+            interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=os.cpu_count())
+            input_index = interpreter.get_input_details()[0]["index"]
+            output_index = interpreter.get_output_details()[0]["index"]
+            interpreter.resize_tensor_input(input_index, (batch_size, 224, 224, 3))
+            interpreter.allocate_tensors()
+            padded = np.zeros((batch_size, 224, 224, 3), dtype=np.float32)
+            # The interpreter holds mutable tensor state, so calls must not overlap
+            runners.append((batch_size, interpreter, input_index, output_index, padded, threading.Lock()))
+    except Exception as e:
+        logger.warning(f"Could not load TFLite model from {model_path}: {e}")
+        return None
+
+    def predict(batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        n = len(batch)
+        batch_size, interpreter, input_index, output_index, padded, lock = next(
+            r for r in runners if r[0] >= n)
+        with lock:
+            if n != batch_size:
+                padded[:n] = batch
+                batch = padded
+            interpreter.set_tensor(input_index, batch)
+            interpreter.invoke()
+            return interpreter.get_tensor(output_index)[:n].copy()
+
+    return predict
+
+
+def make_keras_predict_fn(model, jit_compile: bool = True, labels_only: bool = False):
+    """Trace ``model`` once into a single concrete inference function.
+
+    Returns a callable mapping a float32 (N, 224, 224, 3) batch to (N, 5)
+    probabilities. With ``labels_only`` it instead returns the (N,) int32
+    predicted labels, computed on-device so only those leave the GPU. With
+    ``jit_compile`` XLA fuses the BatchNorm/conv/activation chains of the three
+    backbones. XLA compiles on the first call at each batch shape; if that
+    first call fails for a reason other than running out of memory, XLA is
+    taken to be unavailable on this platform and a regular graph function is
+    used from then on.
+    """
+    def forward(x):
+        probs = model(x, training=False)
+        if labels_only:
+            return tf.argmax(probs, axis=1, output_type=tf.int32)
+        return probs
+
+    spec = tf.TensorSpec([None, 224, 224, 3], tf.float32)
+    infer = tf.function(forward, jit_compile=jit_compile).get_concrete_function(spec)
+    checked = not jit_compile
+
+    def predict(batch):
+        nonlocal infer, checked
+        x = tf.convert_to_tensor(batch, tf.float32)
+        if checked:
+            return infer(x).numpy()
+        try:
+            result = infer(x).numpy()
+        except tf.errors.ResourceExhaustedError:
+            raise
+        except Exception as e:
+            logger.warning(f"XLA compilation failed, using non-XLA graph: {e}")
+            infer = tf.function(forward).get_concrete_function(spec)
+            result = infer(x).numpy()
+        checked = True
+        return result
+
+    return predict
+
+
+def autotune_batch_size(predict_fn, candidates=(64, 32, 16, 8), input_shape=(224, 224, 3), default: int = 8) -> int:
+    """Pick the largest inference batch size that fits in GPU memory.
+
+    Probes ``candidates`` from largest to smallest by calling ``predict_fn``
+    (from make_keras_predict_fn) on a dummy batch, so the program measured is
+    the compiled one evaluation then runs, and the chosen batch shape is
+    already compiled (no gradients, so eval fits larger batches than
+    training). Without a GPU returns ``default``, since CPU throughput barely
+    improves with batch size.
+    """
+    if not tf.config.list_physical_devices("GPU"):
+        return default
+    for bs in sorted(candidates, reverse=True):
+        try:
+            predict_fn(np.zeros((bs,) + tuple(input_shape), dtype=np.float32))
+            return bs
+        except tf.errors.ResourceExhaustedError:
+            continue
+    return min(candidates)
+
+
+def predict_batches(predict_fn, dataset: tf.data.Dataset, num_samples: int, num_classes: int = 5) -> np.ndarray:
+    """Run ``predict_fn`` over every batch of ``dataset``.
+
+    This loop stands in for a single ``model.predict(dataset)`` call: every
+    batch goes through the one concrete function built by
+    make_keras_predict_fn (fixed [None, 224, 224, 3] signature, so nothing is
+    retraced; XLA compiles once for the full batch shape and once for the
+    remainder), while the prefetched dataset keeps preprocessing the next
+    batches. Model.predict would add its own per-step callback and
+    concatenation overhead on top. Results are written straight into a
+    preallocated (num_samples, num_classes) array instead of being collected
+    in a list and concatenated.
+    """
+    probs = np.empty((num_samples, num_classes), dtype=np.float32)
+    start = 0
+    for x in dataset:
+        batch_probs = predict_fn(x)
+        probs[start:start + len(batch_probs)] = batch_probs
+        start += len(batch_probs)
+    assert start == num_samples, f"dataset produced {start} rows, expected {num_samples}"
+    return probs
+
+
+def predict_label_batches(label_fn, dataset: tf.data.Dataset, num_samples: int) -> np.ndarray:
+    """Run a ``make_keras_predict_fn(..., labels_only=True)`` function over ``dataset``.
+
+    Loops over batches for the same reason as predict_batches. Returns a
+    preallocated (num_samples,) array of predicted labels.
+    """
+    labels = np.empty(num_samples, dtype=np.int32)
+    start = 0
+    for x in dataset:
+        batch_labels = label_fn(x)
+        labels[start:start + len(batch_labels)] = batch_labels
+        start += len(batch_labels)
+    assert start == num_samples, f"dataset produced {start} rows, expected {num_samples}"
+    return labels
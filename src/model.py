@@ -1,10 +1,13 @@
+import os
+import threading
 from typing import List
 
+import numpy as np
 import tensorflow as tf
 from tensorflow.keras import Model
 from tensorflow.keras.layers import (Input, BatchNormalization, GlobalAveragePooling2D,
-                                     Dense, Multiply, Conv2D, Flatten, Dropout)
-from tensorflow.keras.applications import VGG16, ResNet50, DenseNet121
+                                     Dense, Multiply, Conv2D, Flatten, Dropout, Resizing, Rescaling)
+from tensorflow.keras.applications import VGG16, ResNet50, DenseNet121, MobileNetV3Large
 
 
 def attention_block(x):
@@ -26,20 +29,21 @@ def attention_block(x):
 
 
 class ModelFusionLayer(tf.keras.layers.Layer):
-    """Custom layer that learns a unique weight for each feature channel across the 3 models.
+    """Custom layer that learns a unique weight for each feature channel across the fused models.
 
-    Expects a list of 3 tensors with identical spatial shape (batch, h, w, channels).
-    Internally stacks them into shape (batch, h, w, models, channels) and applies
-    learnable per-(model,channel) weights followed by a sum across models.
+    Expects a list of tensors (one per backbone) with identical shape (batch, h, w, channels).
+    Applies learnable per-(model,channel) weights and sums across models, one
+    multiply-add per model, without stacking the inputs into a
+    (batch, h, w, models, channels) intermediate.
     """
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
     def build(self, input_shape):
-        # input_shape: list of three shapes
-        if not isinstance(input_shape, list) or len(input_shape) != 3:
-            raise ValueError("ModelFusionLayer requires a list of 3 tensors as input")
+        # input_shape: list of shapes, one per model
+        if not isinstance(input_shape, list) or len(input_shape) < 1:
+            raise ValueError("ModelFusionLayer requires a list of tensors as input")
         _, h, w, c = input_shape[0]
         self.models = len(input_shape)
         self.channels = c
@@ -51,63 +55,221 @@ class ModelFusionLayer(tf.keras.layers.Layer):
         super().build(input_shape)
 
     def call(self, inputs):
-        # stack inputs: shape -> (batch, h, w, models, channels)
-        x = tf.stack(inputs, axis=-2)
-        # expand weights to (1,1,1,models,channels)
-        w = tf.reshape(self.w, (1, 1, 1, self.models, self.channels))
-        weighted = x * w
-        fused = tf.reduce_sum(weighted, axis=-2)  # sum over models -> (batch,h,w,channels)
+        # self.w[m] has shape (channels,) and broadcasts over (batch,h,w)
+        fused = inputs[0] * self.w[0]
+        for m in range(1, self.models):
+            fused = fused + inputs[m] * self.w[m]  # -> (batch,h,w,channels)
         return fused
 
 
-def build_fusion_model(input_shape=(224, 224, 3), num_classes=5):
+def enable_mixed_precision():
+    """Switch Keras to the mixed_float16 policy when a GPU is available.
+
+    Must be called before build_fusion_model. Variables stay float32 so existing
+    checkpoints load unchanged, and model.compile wraps the optimizer in a
+    LossScaleOptimizer automatically. CPUs keep float32 since bfloat16 is
+    emulated (and slower) on most of them. Returns the active policy name.
+    Save models built under this policy with save_float32 / Float32Checkpoint,
+    so the saved layer configs do not carry the float16 policy to CPU hosts.
+    """
+    if tf.config.list_physical_devices("GPU"):
+        tf.keras.mixed_precision.set_global_policy("mixed_float16")
+    return tf.keras.mixed_precision.global_policy().name
+
+
+def save_float32(model, path: str) -> None:
+    """Save a fusion model as a float32-policy model (without optimizer state).
+
+    Under mixed_float16 every layer's dtype policy is serialized with the
+    model, so load_model would run float16 compute even on CPU. The model is
+    then rebuilt under float32 and its weights (float32 variables either way)
+    copied in before saving.
+    """
+    if tf.keras.mixed_precision.global_policy().name == "float32":
+        model.save(path, include_optimizer=False)
+        return
+    policy = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy("float32")
+    try:
+        clone = build_fusion_model(input_shape=tuple(model.input_shape[1:]), num_classes=model.output_shape[-1],
+                                   weights=None, backbones=fusion_backbones(model))
+        clone.set_weights(model.get_weights())
+        clone.save(path, include_optimizer=False)
+    finally:
+        tf.keras.mixed_precision.set_global_policy(policy)
+
+
+class Float32Checkpoint(tf.keras.callbacks.Callback):
+    """ModelCheckpoint counterpart that writes the model through save_float32.
+
+    Supports the subset of ModelCheckpoint options the training scripts use:
+    ``monitor``, ``mode`` ("min" or "max"), ``save_best_only`` and ``verbose``.
+    """
+
+    def __init__(self, filepath: str, monitor: str = "loss", mode: str = "min", save_best_only: bool = True,
+                 verbose: int = 0):
+        super().__init__()
+        self.filepath = filepath
+        self.monitor = monitor
+        self.mode = mode
+        self.save_best_only = save_best_only
+        self.verbose = verbose
+        self.best = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        if self.save_best_only:
+            current = (logs or {}).get(self.monitor)
+            if current is None:
+                return
+            if self.best is not None and (current >= self.best if self.mode == "min" else current <= self.best):
+                return
+            self.best = current
+        if self.verbose:
+            print(f"\nEpoch {epoch + 1}: saving float32 model to {self.filepath}")
+        save_float32(self.model, self.filepath)
+
+
+def prefetch_weights(path: str) -> None:
+    """Start pulling a checkpoint file into the OS page cache.
+
+    Call before building the model so the disk reads overlap graph
+    construction and the later load_weights/load_model hits memory. Uses
+    posix_fadvise(WILLNEED) where available (Linux); elsewhere (e.g. Windows)
+    a daemon thread reads the file through once. Missing paths are ignored.
+    """
+    if not os.path.isfile(path):
+        return
+    if hasattr(os, "posix_fadvise"):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+        return
+
+    def _read_through():
+        with open(path, "rb", buffering=0) as f:
+            while f.read(8 * 1024 * 1024):
+                pass
+
+    threading.Thread(target=_read_through, daemon=True).start()
+
+
+# Backbone constructors by name: (keras.applications class, extra kwargs,
+# input (scale, offset) or None). All give a 7x7 feature map at 224x224.
+# Images arrive scaled to [0, 1], but MobileNetV3Large's ImageNet weights expect
+# [-1, 1], so its built-in [0, 255] rescaling is disabled and a Rescaling layer
+# maps [0, 1] to [-1, 1] in front of it. The original trio is fed [0, 1]
+# directly, as the existing checkpoints were trained that way.
+BACKBONES = {
+    "vgg16": (VGG16, {}, None),
+    "resnet50": (ResNet50, {}, None),
+    "densenet121": (DenseNet121, {}, None),
+    "mobilenetv3": (MobileNetV3Large, {"include_preprocessing": False}, (2.0, -1.0)),
+}
+# Default kept at the original trio so existing checkpoints still load.
+DEFAULT_BACKBONES = ("vgg16", "resnet50", "densenet121")
+# Layer names of the original trio, which the saved checkpoints refer to
+_BASE_NAMES = {"vgg16": "vgg_base", "resnet50": "resnet_base", "densenet121": "densenet_base"}
+
+
+def fusion_backbones(model) -> List[str]:
+    """BACKBONES keys of the backbones in a fusion model, in fusion order.
+
+    Read from the base model layer names, so it also works on a model loaded
+    from a .keras checkpoint.
+    """
+    base_names = {_BASE_NAMES.get(b, f"{b}_base"): b for b in BACKBONES}
+    return [base_names[layer.name] for layer in model.layers if layer.name in base_names]
+
+
+def describe_architecture(backbones) -> str:
+    """Human-readable architecture name, e.g. "VGG16 + ResNet50 + DenseNet121 with Attention"."""
+    return " + ".join(BACKBONES[b][0].__name__ for b in backbones) + " with Attention"
+
+
+def count_trainable_params(model) -> int:
+    """Number of trainable parameters of ``model``.
+
+    Shapes are static, so no device round-trip is needed per weight.
+    """
+    return int(sum(np.prod(w.shape) for w in model.trainable_weights))
+
+
+def load_fusion_checkpoint(path: str):
+    """Rebuild the fusion model in code and load the weights stored at ``path``.
+
+    Only the weights are read (.h5 or .weights.h5), so the model config stored
+    in the file is never deserialized. Call enable_mixed_precision first if the
+    model should run under mixed precision.
+    """
+    prefetch_weights(path)
+    model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5, weights=None)
+    model.load_weights(path)
+    return model
+
+
+def build_fusion_model(input_shape=(224, 224, 3), num_classes=5, weights="imagenet",
+                       backbones=DEFAULT_BACKBONES):
+    # `weights` is passed to the base models. Use weights=None when a full
+    # fusion checkpoint is loaded right after building: it overwrites the
+    # backbones anyway, so fetching and loading ImageNet weights is wasted work.
+    # Layout stays channels_last (NHWC): on GPU, TensorFlow's layout optimizer
+    # already rewrites convolutions to the cuDNN-preferred layout, tensor-core
+    # kernels under mixed_float16 prefer NHWC, and CPU convolutions do not
+    # support NCHW (which would break CPU inference and existing checkpoints).
+    # `backbones` picks the fused feature extractors from BACKBONES, e.g.
+    # ("mobilenetv3", "resnet50", "densenet121") swaps VGG16 (~15 GFLOPs per
+    # image) for MobileNetV3 (~0.2 GFLOPs); such a model must be retrained.
+    unknown = [b for b in backbones if b not in BACKBONES]
+    if unknown:
+        raise ValueError(f"Unknown backbones {unknown}; choose from {sorted(BACKBONES)}")
     inp = Input(shape=input_shape)
 
     # Base models (include_top=False). Instantiate with unique names to avoid
     # duplicate layer name collisions when composing multiple pretrained nets.
-    vgg_base = VGG16(weights="imagenet", include_top=False, name="vgg_base")
-    res_base = ResNet50(weights="imagenet", include_top=False, name="resnet_base")
-    dnet_base = DenseNet121(weights="imagenet", include_top=False, name="densenet_base")
+    bases = []
+    base_inputs = []
+    for b in backbones:
+        cls, kwargs, rescale = BACKBONES[b]
+        bases.append(cls(weights=weights, include_top=False, input_shape=input_shape,
+                         name=_BASE_NAMES.get(b, f"{b}_base"), **kwargs))
+        base_inputs.append(inp if rescale is None else Rescaling(*rescale, name=f"{b}_rescale")(inp))
 
     # Freeze base weights
-    for m in (vgg_base, res_base, dnet_base):
+    for m in bases:
         m.trainable = False
 
-    # Apply each base model to the shared input tensor
-    f1 = vgg_base(inp)
-    f2 = res_base(inp)
-    f3 = dnet_base(inp)
+    # Apply each base model to the shared input tensor (rescaled for backbones
+    # that need it). training=False keeps their BatchNorm layers in inference
+    # mode (frozen moving statistics) even if the bases are later unfrozen for
+    # fine-tuning.
+    features = [m(x, training=False) for m, x in zip(bases, base_inputs)]
 
     # Attention blocks
-    a1 = attention_block(f1)
-    a2 = attention_block(f2)
-    a3 = attention_block(f3)
+    attended = [attention_block(f) for f in features]
 
     # Project each to 512 filters with 1x1 conv
-    p1 = Conv2D(512, kernel_size=1, activation="relu", padding="same")(a1)
-    p2 = Conv2D(512, kernel_size=1, activation="relu", padding="same")(a2)
-    p3 = Conv2D(512, kernel_size=1, activation="relu", padding="same")(a3)
-
-    # Ensure the spatial dims are identical; resize if necessary to the smallest
-    # Compute spatial dims dynamically in a lambda-like manner by applying a Conv2D if needed.
-    # For simplicity, we will up/down-sample p2 and p3 to p1's spatial dims using tf.image.resize
-    _tf = tf
-
-    def _resize_to(reference, var):
-        ref_shape = _tf.shape(reference)[1:3]
-        var_resized = _tf.image.resize(var, size=ref_shape, method="bilinear")
-        return var_resized
+    projected = [Conv2D(512, kernel_size=1, activation="relu", padding="same")(a) for a in attended]
 
-    p2r = _tf.keras.layers.Lambda(lambda args: _resize_to(args[0], args[1]))([p1, p2])
-    p3r = _tf.keras.layers.Lambda(lambda args: _resize_to(args[0], args[1]))([p1, p3])
+    # Ensure the spatial dims are identical: feature maps whose static shape
+    # differs from the first one are bilinearly resized to it. At 224x224 every
+    # backbone gives 7x7, so no resize op is emitted. A Resizing layer (rather
+    # than a Lambda around tf.image.resize) keeps shapes static and the model
+    # serializable without unsafe deserialization.
+    p1 = projected[0]
+    ref_hw = tuple(p1.shape[1:3])
+    resized = [p if tuple(p.shape[1:3]) == ref_hw else Resizing(*ref_hw, interpolation="bilinear")(p)
+               for p in projected[1:]]
 
-    # Fusion: custom layer expects list of three tensors
-    fused = ModelFusionLayer()([p1, p2r, p3r])
+    # Fusion: custom layer expects one tensor per backbone
+    fused = ModelFusionLayer()([p1] + resized)
 
     flat = Flatten()(fused)
     dense = Dense(256, activation="relu")(flat)
     drop = Dropout(0.5)(dense)
-    out = Dense(num_classes, activation="softmax")(drop)
+    # keep the softmax in float32 for numerical stability under mixed precision
+    out = Dense(num_classes, activation="softmax", dtype="float32")(drop)
 
     model = Model(inputs=inp, outputs=out, name="fusion_dr_model")
     return model
@@ -1,12 +1,42 @@
+import functools
+import hashlib
 import os
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
 
 import cv2
 import numpy as np
 import pandas as pd
+import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.utils import Sequence, to_categorical
 
+# Preprocessed training images written by cache_preprocessed.py: a uint8
+# (N, 224, 224, 3) RGB .npy aligned with the rows of data/train.csv, plus a
+# sidecar file holding the preprocessing fingerprint and the id_codes it was
+# built from
+TRAIN_CACHE_PATH = os.path.join("data", "train_preprocessed.npy")
+
+# Version of the image preprocessing pipeline (_load_uint8 and the helpers it
+# calls). Bump it whenever a change alters the output pixels, so existing
+# preprocessed caches are recognized as stale.
+PREPROCESS_VERSION = 2
+
+
+@functools.lru_cache(maxsize=16)
+def _circle_mask(h: int, w: int) -> np.ndarray:
+    """Build (once per image shape) the uint8 mask of the centered inscribed circle.
+
+    Fundus datasets come from a handful of camera resolutions, so a small
+    cache keeps mask construction out of the per-image loop.
+    """
+    center = (w // 2, h // 2)
+    radius = min(center[0], center[1], w - center[0], h - center[1])
+    mask = np.zeros((h, w), dtype=np.uint8)
+    cv2.circle(mask, center, radius, 255, -1)
+    mask.setflags(write=False)
+    return mask
+
 
 def _circular_crop(img: np.ndarray) -> np.ndarray:
     """Apply circular crop to remove black borders around fundus image.
@@ -18,51 +48,153 @@ def _circular_crop(img: np.ndarray) -> np.ndarray:
         cropped image with background outside circle kept as black.
     """
     h, w = img.shape[:2]
-    center = (w // 2, h // 2)
-    radius = min(center[0], center[1], w - center[0], h - center[1])
-    mask = np.zeros((h, w), dtype=np.uint8)
-    cv2.circle(mask, center, radius, 255, -1)
-    if img.ndim == 3:
-        masked = cv2.bitwise_and(img, img, mask=mask)
-    else:
-        masked = cv2.bitwise_and(img, img, mask=mask)
+    masked = cv2.bitwise_and(img, img, mask=_circle_mask(h, w))
     return masked
 
 
 def _gaussian_blur(img: np.ndarray, sigma: float = 10.0) -> np.ndarray:
     """Apply Gaussian blur with given sigma using OpenCV.
 
-    Uses ksize=(0,0) so OpenCV computes a kernel from sigma.
+    Uses ksize=(0,0) so OpenCV computes a kernel from sigma. cv2.GaussianBlur
+    is kept (rather than a float sepFilter2D) because on uint8 images it uses
+    OpenCV's bit-exact fixed-point kernel, which the published weights were
+    trained with.
     """
     blurred = cv2.GaussianBlur(img, ksize=(0, 0), sigmaX=sigma, sigmaY=sigma)
     return blurred
 
 
-def _load_and_preprocess(image_path: str, target_size=(224, 224)) -> np.ndarray:
-    # Read with OpenCV (BGR), convert to RGB
-    img_bgr = cv2.imread(image_path)
-    if img_bgr is None:
-        raise FileNotFoundError(f"Image not found: {image_path}")
-    img = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+def _crop_blur_resize(img: np.ndarray, target_size=(224, 224)) -> np.ndarray:
+    """Circular crop, Gaussian blur (sigma=10) and resize to ``target_size``.
 
-    # Circular crop
+    This is the pipeline the published weights were trained with: the blur runs
+    at the original resolution, before the resize. Every step works per
+    channel, so channel order is irrelevant.
+    """
     img = _circular_crop(img)
-
-    # Gaussian blur (sigma=10)
     img = _gaussian_blur(img, sigma=10.0)
+    return cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
+
+
+def _load_uint8(image_path: str, target_size=(224, 224)) -> np.ndarray:
+    """Load an image and apply the preprocessing pipeline, stopping before the
+    [0,1] scaling. Returns a HxWx3 uint8 RGB image."""
+    # Read with OpenCV (BGR)
+    img_bgr = cv2.imread(image_path)
+    if img_bgr is None:
+        raise FileNotFoundError(f"Image not found: {image_path}")
 
-    # Resize to target
-    img = cv2.resize(img, target_size, interpolation=cv2.INTER_AREA)
+    # Circular crop, Gaussian blur (sigma=10), resize to target
+    img = _crop_blur_resize(img_bgr, target_size=target_size)
 
-    # Ensure 3 channels
+    # Convert to RGB on the small image (ensures 3 channels)
     if img.ndim == 2:
         img = cv2.cvtColor(img, cv2.COLOR_GRAY2RGB)
+    else:
+        img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+    return img
+
+
+def _load_and_preprocess(image_path: str, target_size=(224, 224)) -> np.ndarray:
+    img = _load_uint8(image_path, target_size=target_size)
 
     # Scale to [0,1]
     img = img.astype(np.float32) / 255.0
     return img
 
 
+def preprocess_fingerprint(image_paths: List[str], target_size=(224, 224)) -> str:
+    """Hash of PREPROCESS_VERSION, the target size and the source image files.
+
+    Stored next to the preprocessed cache, so the cache is recognized as stale
+    when the pipeline version changes or an image is replaced (by size and
+    modification time).
+    """
+    h = hashlib.sha256()
+    h.update(f"v{PREPROCESS_VERSION}".encode())
+    h.update(repr(tuple(target_size)).encode())
+    for p in image_paths:
+        st = os.stat(p)
+        h.update(f"{os.path.basename(p)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
+def write_preprocessed_cache(cache_path: str, image_paths: List[str], id_codes: List[str], fingerprint: str,
+                             target_size=(224, 224)) -> None:
+    """Preprocess ``image_paths`` into the uint8 .npy cache and write its sidecar."""
+    # Invalidate any previous cache while it is being rewritten
+    ids_path = cache_path + ".ids.txt"
+    if os.path.exists(ids_path):
+        os.remove(ids_path)
+
+    cache = np.lib.format.open_memmap(cache_path, mode="w+", dtype=np.uint8,
+                                      shape=(len(image_paths), target_size[1], target_size[0], 3))
+    # OpenCV releases the GIL, so threads preprocess images in parallel
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+        for i, img in enumerate(ex.map(lambda p: _load_uint8(p, target_size=target_size), image_paths)):
+            cache[i] = img
+            if (i + 1) % 500 == 0:
+                print(f"{i + 1}/{len(image_paths)} done...")
+    cache.flush()
+    del cache
+
+    # Written last: the cache is only used when this sidecar matches
+    with open(ids_path, "w") as f:
+        f.write("\n".join([fingerprint] + list(id_codes)) + "\n")
+
+
+def _open_preprocessed_cache(cache_path: str, id_codes: List[str], fingerprint: str,
+                             target_size=(224, 224)) -> Optional[np.ndarray]:
+    """Memory-map the preprocessed image cache if it matches ``id_codes`` row for row.
+
+    Returns None when the cache is missing or stale (built from a different CSV,
+    target size, preprocessing version or source images).
+    """
+    ids_path = cache_path + ".ids.txt"
+    if not (os.path.exists(cache_path) and os.path.exists(ids_path)):
+        return None
+    with open(ids_path) as f:
+        if f.read().split() != [fingerprint] + list(id_codes):
+            return None
+    cache = np.load(cache_path, mmap_mode="r")
+    if cache.shape != (len(id_codes), target_size[1], target_size[0], 3):
+        return None
+    return cache
+
+
+_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def build_image_index(images_dir: str) -> Dict[str, str]:
+    """Map id_code -> image path for every image in ``images_dir`` with one scan.
+
+    Replaces probing up to four paths per image with a dict lookup. An id_code
+    resolves to ``<id_code>.png``, ``.jpg`` or ``.jpeg`` (in that order of
+    preference), falling back to a file named exactly ``id_code``.
+    """
+    index = {}
+    rank = {}
+    names = {}
+    if not os.path.isdir(images_dir):
+        return index
+    with os.scandir(images_dir) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            names[entry.name] = entry.path
+            stem, ext = os.path.splitext(entry.name)
+            ext = ext.lower()
+            if ext in _IMAGE_EXTENSIONS:
+                r = _IMAGE_EXTENSIONS.index(ext)
+                if r < rank.get(stem, len(_IMAGE_EXTENSIONS)):
+                    index[stem] = entry.path
+                    rank[stem] = r
+    # fallback: raw id_code path
+    for name, path in names.items():
+        index.setdefault(name, path)
+    return index
+
+
 class TrainSequence(Sequence):
     """Keras Sequence to load and augment APTOS images with required preprocessing.
 
@@ -71,7 +203,8 @@ class TrainSequence(Sequence):
     """
 
     def __init__(self, csv_path: str = "data/train.csv", images_dir: str = "data/train_images",
-                 batch_size: int = 16, target_size=(224, 224), shuffle: bool = True, num_classes: int = 5):
+                 batch_size: int = 16, target_size=(224, 224), shuffle: bool = True, num_classes: int = 5,
+                 cache_path: Optional[str] = None):
         self.df = pd.read_csv(csv_path)
         self.images_dir = images_dir
         self.batch_size = batch_size
@@ -79,6 +212,26 @@ class TrainSequence(Sequence):
         self.shuffle = shuffle
         self.num_classes = num_classes
 
+        # id_code -> image path, built with a single directory scan
+        self._index = build_image_index(images_dir)
+
+        # preprocessed image cache (see cache_preprocessed.py); when present,
+        # batches skip decoding, cropping, blurring and resizing entirely.
+        # A stale cache is ignored with a warning rather than silently serving
+        # old pixels; rebuilding it is left to cache_preprocessed.py.
+        self.cache = None
+        if cache_path is not None and os.path.exists(cache_path):
+            id_codes = [str(i).strip() for i in self.df["id_code"]]
+            paths = [self._index.get(i) for i in id_codes]
+            if None in paths:
+                print(f"Warning: not all images found in {images_dir}, ignoring cache {cache_path}")
+            else:
+                fingerprint = preprocess_fingerprint(paths, target_size=target_size)
+                self.cache = _open_preprocessed_cache(cache_path, id_codes, fingerprint, target_size=target_size)
+                if self.cache is None:
+                    print(f"Warning: preprocessed cache {cache_path} is stale (CSV, images or preprocessing "
+                          f"changed), preprocessing images on the fly. Run cache_preprocessed.py to rebuild it.")
+
         # augmentation generator for random transforms
         self.aug = ImageDataGenerator(horizontal_flip=True, vertical_flip=True)
 
@@ -94,43 +247,99 @@ class TrainSequence(Sequence):
             np.random.shuffle(self.indexes)
 
     def _find_image_file(self, id_code: str) -> Optional[str]:
-        # try common extensions
-        for ext in (".png", ".jpg", ".jpeg"):
-            p = os.path.join(self.images_dir, id_code + ext)
-            if os.path.exists(p):
-                return p
-        # fallback: try raw id_code path
-        p = os.path.join(self.images_dir, id_code)
-        if os.path.exists(p):
-            return p
-        return None
+        return self._index.get(id_code)
 
-    def __getitem__(self, idx):
-        batch_indexes = self.indexes[idx * self.batch_size:(idx + 1) * self.batch_size]
-        batch_df = self.df.iloc[batch_indexes]
+    def _load_sample(self, row_idx: int):
+        """Load, preprocess and augment the sample at CSV row ``row_idx``.
 
-        images = []
-        labels = []
-        for _, row in batch_df.iterrows():
-            id_code = str(row["id_code"]).strip()
-            lab = int(row["diagnosis"])
+        Returns the (h, w, 3) float32 image and its one-hot label.
+        """
+        row = self.df.iloc[row_idx]
+        id_code = str(row["id_code"]).strip()
+        lab = int(row["diagnosis"])
+        if self.cache is not None:
+            img = self.cache[row_idx].astype(np.float32) / 255.0
+        else:
             img_path = self._find_image_file(id_code)
             if img_path is None:
                 raise FileNotFoundError(f"Image for id {id_code} not found in {self.images_dir}")
             img = _load_and_preprocess(img_path, target_size=self.target_size)
 
-            # apply random augmentation transforms
-            img = self.aug.random_transform(img)
+        # apply random augmentation transforms
+        img = self.aug.random_transform(img)
 
+        return img, to_categorical(lab, num_classes=self.num_classes)
+
+    def __getitem__(self, idx):
+        batch_indexes = self.indexes[idx * self.batch_size:(idx + 1) * self.batch_size]
+
+        images = []
+        labels = []
+        for row_idx in batch_indexes:
+            img, lab = self._load_sample(row_idx)
             images.append(img)
             labels.append(lab)
 
         x = np.stack(images, axis=0)
-        y = to_categorical(labels, num_classes=self.num_classes)
+        y = np.stack(labels, axis=0)
         return x, y
 
 
 def get_train_generator(batch_size: int = 16) -> TrainSequence:
     """Factory for the train generator with required augmentation and preprocessing."""
     return TrainSequence(csv_path=os.path.join("data", "train.csv"), images_dir=os.path.join("data", "train_images"),
-                         batch_size=batch_size, target_size=(224, 224), shuffle=True, num_classes=5)
+                         batch_size=batch_size, target_size=(224, 224), shuffle=True, num_classes=5,
+                         cache_path=TRAIN_CACHE_PATH)
+
+
+def get_train_dataset(batch_size: int = 16) -> tf.data.Dataset:
+    """tf.data pipeline over the train generator's samples.
+
+    Samples are loaded, preprocessed and augmented on parallel tf.data workers
+    (OpenCV releases the GIL) and batches are prefetched, so image loading
+    overlaps with the training step instead of running on a single thread.
+    Sample order is reshuffled every epoch.
+    """
+    train_gen = get_train_generator(batch_size=batch_size)
+    num_samples = len(train_gen.df)
+    image_shape = (train_gen.target_size[1], train_gen.target_size[0], 3)
+
+    def _load(row_idx):
+        img, lab = train_gen._load_sample(int(row_idx))
+        return img.astype(np.float32, copy=False), lab.astype(np.float32, copy=False)
+
+    def _tf_load(row_idx):
+        img, lab = tf.numpy_function(_load, [row_idx], (tf.float32, tf.float32))
+        img.set_shape(image_shape)
+        lab.set_shape((train_gen.num_classes,))
+        return img, lab
+
+    ds = tf.data.Dataset.range(num_samples)
+    if train_gen.shuffle:
+        ds = ds.shuffle(num_samples, reshuffle_each_iteration=True)
+    ds = ds.map(_tf_load, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def get_eval_dataset(image_paths: List[str], batch_size: int = 8, target_size=(224, 224)) -> tf.data.Dataset:
+    """Batched tf.data pipeline over ``image_paths`` (no augmentation).
+
+    Images are loaded and preprocessed on parallel tf.data workers (OpenCV
+    releases the GIL) and prefetched, so preprocessing overlaps inference.
+    Batches keep the order of ``image_paths``.
+    """
+
+    def _load(path):
+        return _load_and_preprocess(path.numpy().decode("utf-8"), target_size=target_size)
+
+    def _tf_load(path):
+        img = tf.py_function(_load, [path], tf.float32)
+        img.set_shape((target_size[1], target_size[0], 3))
+        return img
+
+    options = tf.data.Options()
+    options.threading.private_threadpool_size = os.cpu_count()
+
+    ds = tf.data.Dataset.from_tensor_slices(list(image_paths))
+    ds = ds.map(_tf_load, num_parallel_calls=tf.data.AUTOTUNE)
+    return ds.with_options(options).batch(batch_size).prefetch(tf.data.AUTOTUNE)
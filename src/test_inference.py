@@ -4,45 +4,37 @@ import numpy as np
 import pandas as pd
 import tensorflow as tf
 
-# Allow loading legacy HDF5 models that contain Python lambda in Lambda layers.
-# This is potentially unsafe if the file is untrusted; here we enable it because
-# the model was created in this workspace.
-try:
-    from keras import config as keras_config
-    keras_config.enable_unsafe_deserialization()
-except Exception:
-    # older/newer TF/Keras versions may differ; ignore if not available
-    pass
-
-from model import ModelFusionLayer, build_fusion_model
+from model import ModelFusionLayer, load_fusion_checkpoint
+from inference_backend import (TFLITE_MODEL_PATH, is_export_current, load_tflite_predict_fn, make_keras_predict_fn,
+                              predict_batches)
 
 # reuse preprocessing helper from our module
-from preprocessing import _load_and_preprocess
+from preprocessing import build_image_index, get_eval_dataset
 
-
-def find_image(images_dir, id_code):
-    for ext in (".png", ".jpg", ".jpeg"):
-        p = os.path.join(images_dir, id_code + ext)
-        if os.path.exists(p):
-            return p
-    p = os.path.join(images_dir, id_code)
-    if os.path.exists(p):
-        return p
-    return None
+# Fixed inference chunk size so a large --num cannot run the model out of memory
+BATCH_SIZE = 8
 
 
 def main(args):
-    model_path = args.model or os.path.join(os.getcwd(), "fusion_dr_model.h5")
-    print("Loading model (compile=False, safe_mode=False)...", model_path)
-    # Pass safe_mode=False to allow deserializing Lambda layers that use Python
-    # lambdas. This is safe here because the model file was created inside this
-    # project. Do NOT do this with untrusted files.
-    # Rebuild the model architecture from code and load weights from the HDF5.
-    # This avoids deserialization issues with Lambda layers/custom objects.
-    print("Building model architecture and loading weights from:", model_path)
-    model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5)
-    model.load_weights(model_path)
-    print("Model built and weights loaded.")
+    # On CPU-only machines prefer the INT8 TFLite export (see
+    # convert_to_tflite.py) unless a specific model file was requested, as
+    # long as it was converted from the checkpoint on disk
+    predict_fn = None
+    tflite_path = os.path.join(os.getcwd(), TFLITE_MODEL_PATH)
+    if (args.model is None and not tf.config.list_physical_devices("GPU") and os.path.exists(tflite_path)
+            and is_export_current(tflite_path, os.getcwd())):
+        predict_fn = load_tflite_predict_fn(tflite_path, batch_sizes=(BATCH_SIZE,))
+        if predict_fn is not None:
+            print("Using INT8 TFLite model:", TFLITE_MODEL_PATH)
+
+    if predict_fn is None:
+        model_path = args.model or os.path.join(os.getcwd(), "fusion_dr_model.h5")
+        # Rebuild the model architecture from code and load only the weights
+        # from the HDF5, so no custom objects are needed.
+        print("Building model architecture and loading weights from:", model_path)
+        model = load_fusion_checkpoint(model_path)
+        print("Model built and weights loaded.")
+        predict_fn = make_keras_predict_fn(model)
 
     csv_path = args.csv or os.path.join(os.getcwd(), "data", "train.csv")
     images_dir = args.images or os.path.join(os.getcwd(), "data", "train_images")
@@ -52,24 +44,25 @@ def main(args):
 
     sample_ids = ids[: args.num] if args.num > 0 else ids[:5]
 
-    imgs = []
+    image_index = build_image_index(images_dir)
+    paths = []
     found = []
     for id_code in sample_ids:
-        p = find_image(images_dir, id_code)
+        p = image_index.get(id_code)
         if p is None:
             print(f"Warning: image for id {id_code} not found in {images_dir}")
             continue
-        img = _load_and_preprocess(p, target_size=(224, 224))
-        imgs.append(img)
+        paths.append(p)
         found.append(id_code)
 
-    if len(imgs) == 0:
+    if len(paths) == 0:
         print("No images found to run inference on. Exiting.")
         return
 
-    x = np.stack(imgs, axis=0)
-    print(f"Running inference on {x.shape[0]} samples...")
-    preds = model.predict(x)
+    # Images are preprocessed on parallel tf.data workers (OpenCV releases the
+    # GIL) while earlier chunks run through the model
+    print(f"Running inference on {len(paths)} samples...")
+    preds = predict_batches(predict_fn, get_eval_dataset(paths, batch_size=BATCH_SIZE), num_samples=len(paths))
 
     # Map class indices to human-readable severity levels
     severity_map = {
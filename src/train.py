@@ -2,10 +2,17 @@ import os
 
 import tensorflow as tf
 
-from preprocessing import get_train_generator
-from model import build_fusion_model
+from preprocessing import get_train_dataset
+from model import DEFAULT_BACKBONES, Float32Checkpoint, build_fusion_model, enable_mixed_precision, save_float32
 from loss import focal_loss
 
+# --- CONFIG ---
+# Fused feature extractors (keys of model.BACKBONES), e.g.
+# ("mobilenetv3", "resnet50", "densenet121") for a much lighter model than the
+# default trio. Checkpoints trained with other backbones load through
+# tf.keras.models.load_model; the rebuild-and-load_weights paths assume the default.
+BACKBONES = DEFAULT_BACKBONES
+
 
 def main():
     # reduce batch size to lower OOM risk for the large fusion model
@@ -26,11 +33,15 @@ def main():
         # Memory growth may not be supported in some TF builds; warn but continue
         print("Warning: Could not set TensorFlow GPU memory growth:", e)
 
-    print("Preparing data generator...")
-    train_gen = get_train_generator(batch_size=batch_size)
+    print("Preparing data pipeline...")
+    train_ds = get_train_dataset(batch_size=batch_size)
+
+    # mixed_float16 on GPU: tensor-core convolutions and half the activation
+    # memory; the softmax output stays float32 and compile() adds loss scaling
+    print(f"Using dtype policy: {enable_mixed_precision()}")
 
-    print("Building model...")
-    model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5)
+    print(f"Building model with backbones {', '.join(BACKBONES)}...")
+    model = build_fusion_model(input_shape=(224, 224, 3), num_classes=5, backbones=BACKBONES)
 
     print("Compiling model with Adam and Focal Loss...")
     opt = tf.keras.optimizers.Adam(learning_rate=1e-4)
@@ -42,29 +53,25 @@ def main():
     # Fit
     print("Starting training for {} epochs".format(epochs))
     # Prepare callbacks: save native Keras format (.keras) during training to avoid
-    # HDF5 lambda/custom-object issues when reloading the full model later.
+    # custom-object issues when reloading the full model later. Checkpoints are
+    # written as float32 models, so loading them on CPU does not run float16.
     ckpt_path = os.path.join(os.getcwd(), "fusion_dr_model.keras")
-    checkpoint_cb = tf.keras.callbacks.ModelCheckpoint(
-        ckpt_path,
-        save_best_only=True,
-        monitor="loss",
-        mode="min",
-        save_weights_only=False,
-        save_format="keras",
-    )
+    checkpoint_cb = Float32Checkpoint(ckpt_path, monitor="loss", mode="min", save_best_only=True)
 
-    model.fit(train_gen, epochs=epochs, callbacks=[checkpoint_cb])
+    # Samples are loaded on parallel tf.data workers, so the model is not
+    # starved by single-threaded preprocessing
+    model.fit(train_ds, epochs=epochs, callbacks=[checkpoint_cb])
 
     # Save model
     # Save final model in both native Keras and legacy HDF5 formats for compatibility.
     keras_out = os.path.join(os.getcwd(), "fusion_dr_model.keras")
     h5_out = os.path.join(os.getcwd(), "fusion_dr_model.h5")
+    # Both are saved as float32 models without optimizer state (which can
+    # require custom objects), whatever policy training ran under.
     print(f"Saving final model to {keras_out} (native Keras format)")
-    model.save(keras_out, include_optimizer=False)
+    save_float32(model, keras_out)
     print(f"Also saving legacy HDF5 to {h5_out}")
-    # Save HDF5 for backward compatibility; include_optimizer=False to avoid
-    # serializing optimizer state which can require custom objects.
-    model.save(h5_out, include_optimizer=False)
+    save_float32(model, h5_out)
 
 
 if __name__ == "__main__":